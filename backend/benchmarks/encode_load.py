@@ -0,0 +1,88 @@
+"""
+Load test for sentence encoding: many concurrent clients sending autocomplete-style
+queries (growing prefixes of a few phrases), served either by calling model.encode
+per request or through EncodeBatcher. Prints throughput and latency percentiles as
+one JSON line per configuration.
+
+    python benchmarks/encode_load.py --clients 16 --requests 50
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.batching import EncodeBatcher  # noqa: E402
+
+PHRASES = [
+    "dog cancer",
+    "breast cancer susceptibility gene",
+    "asbestos exposure mesothelioma",
+    "insulin resistance type 2 diabetes",
+    "calcium voltage-gated channel",
+    "tumor necrosis factor alpha",
+]
+
+
+def autocomplete_queries(n: int, rng):
+    """Prefixes of random phrases, the way a search box sends them while typing."""
+    queries = []
+    while len(queries) < n:
+        phrase = PHRASES[rng.integers(len(PHRASES))]
+        queries.extend(phrase[:i] for i in range(3, len(phrase) + 1))
+    return queries[:n]
+
+
+def run_load(encode_one, clients: int, requests: int, seed: int = 0):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(i):
+        rng = np.random.default_rng(seed + i)
+        for query in autocomplete_queries(requests, rng):
+            start = time.perf_counter()
+            encode_one(query)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / wall,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bert-base-nli-mean-tokens")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model)
+    model.encode(["warmup"])
+
+    configs = {
+        "direct": lambda: (lambda query: model.encode([query])[0]),
+        "batched": lambda: EncodeBatcher(model.encode, cache_size=0).encode,
+        "batched+cache": lambda: EncodeBatcher(model.encode).encode,
+    }
+    for name, make_encoder in configs.items():
+        result = run_load(make_encoder(), args.clients, args.requests)
+        print(json.dumps({"mode": name, **result}))
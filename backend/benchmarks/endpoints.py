@@ -0,0 +1,383 @@
+"""
+Benchmarks the search paths behind bert_query, compute_expression,
+get_similar_concepts, autosuggest and free_var_search on synthetic data, so runs are
+reproducible and comparable between commits without the real embeddings.
+
+For each size, a clustered synthetic BCV store of that many concepts (with its
+lookup, descriptions, suggest index, int8 quantized copy and k-NN graph) and a BERT
+matrix of that many sentences are written to a temporary directory with the same
+builders clean_data.py uses. Each case then runs in a fresh process, so its peak RSS
+is its own: it loads what its endpoint requires with core.init, runs a warm-up call
+and times repeated calls of the endpoint's body from core.endpoints. bert_query is
+timed from the encoded query vector on, since the synthetic data has no model.
+free_var_search is run for every given n.
+
+Results are written as JSON (latency p50/p99/mean, throughput, baseline and peak RSS
+per case, plus the commit and machine they were measured on). With --compare, the
+p50s are also checked against an earlier results file.
+
+    python benchmarks/endpoints.py --sizes 10000,100000 --ns 1000,10000 \\
+        --out bench.json --compare bench_previous.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import init as resources  # noqa: E402
+from core import endpoints  # noqa: E402
+from core.store import write_BCV_store, save_BCV_lookup, normalize_rows  # noqa: E402
+from core.ann import build_ann_index, save_ann_index, BERT_ANN_FILE  # noqa: E402
+from core.quantize import write_quantized_store  # noqa: E402
+from core.knn import build_knn_graph  # noqa: E402
+from core.descriptions import save_description_store  # noqa: E402
+from core.suggest import build_suggest_index, save_suggest_index  # noqa: E402
+
+BERT_FILE = "BERT_embeddings.npy"
+BERT_SENTENCES_FILE = "BERT_sentences.npy"
+
+CASES = (
+    "bert_query",
+    "compute_expression",
+    "get_similar_concepts",
+    "autosuggest",
+    "free_var_search",
+)
+
+# what each case require()s, as its endpoint does before running
+CASE_RESOURCES = {
+    "bert_query": ("BERT_embeddings", "BERT_sentences"),
+    "compute_expression": ("BCV_list", "BCV_store", "BCV_ann_index", "BCV_quantized"),
+    "get_similar_concepts": ("BCV_list", "BCV_knn_graph"),
+    "autosuggest": ("BCV_list", "BCV_descriptions", "BCV_suggest_index"),
+    "free_var_search": ("BCV_list", "BCV_store", "BCV_quantized", "BCV_descriptions"),
+}
+
+CONCEPT_TYPES = ("Gene", "Disease_MESH", "Chemical_MESH", "Species", "SNP")
+
+WORDS = (
+    "cancer",
+    "carcinoma",
+    "cardiac",
+    "insulin",
+    "inflammation",
+    "kinase",
+    "receptor",
+    "protein",
+    "tumor",
+    "syndrome",
+    "diabetes",
+    "calcium",
+    "channel",
+    "asbestos",
+    "lung",
+    "liver",
+    "breast",
+    "deficiency",
+    "factor",
+    "necrosis",
+)
+
+
+def synthetic_vectors(n: int, dim: int, seed: int, clusters: int = 256):
+    """
+    Yields n vectors around random cluster centres, one block at a time. Clustered
+    rather than uniform, so nearest neighbours and free variable hits are as rare or
+    as common as they would be in a real embedding.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    for start in range(0, n, 4_096):
+        size = min(4_096, n - start)
+        assigned = centres[rng.integers(clusters, size=size)]
+        yield assigned + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+
+
+def synthetic_concept(i: int):
+    return f"{CONCEPT_TYPES[i % len(CONCEPT_TYPES)]}_{i}"
+
+
+def synthetic_description(i: int):
+    return f"{WORDS[i % len(WORDS)]} {WORDS[(i // len(WORDS)) % len(WORDS)]} {i}"
+
+
+def build_dataset(path: str, n: int, dim: int, bert_dim: int, seed: int, ann: bool):
+    """Writes every artifact the benchmarked paths read for a store of n concepts."""
+    timings = {}
+
+    start = time.perf_counter()
+    items = (
+        (synthetic_concept(i), vector)
+        for i, vector in enumerate(
+            row for block in synthetic_vectors(n, dim, seed) for row in block
+        )
+    )
+    key_len = len(max(CONCEPT_TYPES, key=len)) + 1 + len(str(n - 1))
+    BCV_list, normed, _ = write_BCV_store(path, items, n, dim, key_len)
+    save_BCV_lookup(path, BCV_list)
+    timings["store"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    descriptions = {synthetic_concept(i): synthetic_description(i) for i in range(n)}
+    save_description_store(path, BCV_list, descriptions)
+    save_suggest_index(path, build_suggest_index(BCV_list, descriptions))
+    timings["descriptions"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_quantized_store(path, normed, "int8")
+    timings["quantized"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    build_knn_graph(path, normed)
+    timings["knn_graph"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # written one normalized block at a time, like the store, so the n x bert_dim
+    # matrix is never in memory at once
+    BERT_embeddings = np.lib.format.open_memmap(
+        os.path.join(path, BERT_FILE), mode="w+", dtype=np.float32, shape=(n, bert_dim)
+    )
+    offset = 0
+    for block in synthetic_vectors(n, bert_dim, seed + 1):
+        BERT_embeddings[offset : offset + len(block)] = normalize_rows(block)[0]
+        offset += len(block)
+    BERT_embeddings.flush()
+    sentences = np.array([synthetic_description(i) for i in range(n)])
+    np.save(os.path.join(path, BERT_SENTENCES_FILE), sentences)
+    timings["bert"] = time.perf_counter() - start
+
+    if ann:
+        start = time.perf_counter()
+        save_ann_index(path, build_ann_index(normed))
+        save_ann_index(path, build_ann_index(BERT_embeddings), BERT_ANN_FILE)
+        timings["ann"] = time.perf_counter() - start
+    return timings
+
+
+def peak_rss_mb():
+    # ru_maxrss survives exec on Linux, so a spawned child would report its parent's
+    # peak; VmHWM belongs to the process's own address space
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def case_call(case: str, path: str, size: int, n: int, seed: int):
+    """
+    Loads what case's endpoint requires from the store of size concepts in path with
+    core.init and returns a
+    function running one request of it through core.endpoints, plus the number of
+    work items (equations for free_var_search) per request.
+    """
+    if case not in CASES:
+        raise ValueError(f"Unknown case {case}, expected one of {CASES}")
+    resources.DATA_PATH = path
+    resources.require(*CASE_RESOURCES[case])
+    rng = np.random.default_rng(seed)
+    concepts = [synthetic_concept(i) for i in rng.integers(size, size=64)]
+
+    if case == "bert_query":
+        dim = resources.BERT_embeddings.shape[1]
+        queries = normalize_rows(rng.standard_normal((64, dim)).astype(np.float32))[0]
+
+        def call(i):
+            query_vector = queries[i % len(queries)][None, :]
+            return endpoints.bert_matches(resources, query_vector, 10)
+
+        return call, 1
+
+    if case == "compute_expression":
+
+        def call(i):
+            terms = [concepts[(i + j) % len(concepts)] for j in range(3)]
+            expression = [terms[0], "+", terms[1], "-", terms[2]]
+            result = endpoints.expression_vector(resources, expression)
+            return endpoints.top_BCV_matches(resources, result, 10)[0]
+
+        return call, 1
+
+    if case == "get_similar_concepts":
+
+        def call(i):
+            row = endpoints.BCV_index(resources, concepts[i % len(concepts)])
+            return endpoints.graph_similar_concepts(resources, row, 10)
+
+        return call, 1
+
+    if case == "autosuggest":
+        # typed prefixes of the description words, short ones included
+        prefixes = [word[:length] for word in WORDS for length in (2, 4, len(word))]
+
+        def call(i):
+            return endpoints.suggest_concepts(resources, prefixes[i % len(prefixes)], 10)
+
+        return call, 1
+
+    hits = []
+
+    def call(i):
+        q = concepts[i % len(concepts)]
+        q_index = endpoints.BCV_index(resources, q)
+        pairs = endpoints.free_var_pairs(resources, q_index, n, seed + i)
+        results = endpoints.free_var_results(resources, q_index, pairs, 0.80)
+        hits.append(len(results[0]))
+        return endpoints.free_var_frame(resources, q, q_index, *results)
+
+    call.hits = hits
+    return call, n
+
+
+def run_case(case: str, path: str, size: int, n: int, repeats: int, seed: int):
+    """Times repeats calls of case after one warm-up call; runs in its own process."""
+    call, items = case_call(case, path, size, n, seed)
+    baseline_rss = peak_rss_mb()
+    call(0)
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(1, repeats + 1):
+        call_start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "calls": repeats,
+        "p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "p99_ms": 1000 * float(np.percentile(latencies, 99)),
+        "mean_ms": 1000 * float(np.mean(latencies)),
+        "calls_per_sec": repeats / elapsed,
+        "items_per_sec": repeats * items / elapsed,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if hasattr(call, "hits"):
+        # without the warm-up call
+        result["hits_per_call"] = float(np.mean(call.hits[1:]))
+    return result
+
+
+def run_isolated(*args):
+    # spawn rather than fork, so the child doesn't inherit the parent's peak RSS
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_case, args)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict):
+    return result["size"], result["case"], result.get("n")
+
+
+def compare(results: list, previous_path: str, tolerance: float):
+    """Prints the p50 ratio of every case also in the previous results file."""
+    with open(previous_path) as f:
+        previous = {result_key(r): r for r in json.load(f)["results"]}
+    regressions = 0
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        regressed = ratio > 1 + tolerance
+        regressions += regressed
+        print(
+            f"{result['case']:>22} size={result['size']:<9} n={result.get('n')}: "
+            f"p50 {before['p50_ms']:.3f} -> {result['p50_ms']:.3f} ms "
+            f"(x{ratio:.2f}){' REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int_list, default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--bert-dim", type=int, default=768)
+    parser.add_argument("--ns", type=int_list, default=[1_000, 10_000])
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--free-var-repeats", type=int, default=5)
+    parser.add_argument("--ann", action="store_true", help="also build HNSW indexes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare p50s with")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    cases = args.cases.split(",")
+    for case in cases:
+        if case not in CASES:
+            parser.error(f"Unknown case {case}, expected one of {CASES}")
+
+    results, builds = [], {}
+    for size in args.sizes:
+        path = tempfile.mkdtemp(prefix=f"bcv-bench-{size}-")
+        try:
+            print(f"- Building synthetic data for {size} concepts...", flush=True)
+            builds[size] = build_dataset(
+                path, size, args.dim, args.bert_dim, args.seed, args.ann
+            )
+            for case in cases:
+                ns = args.ns if case == "free_var_search" else [None]
+                repeats = (
+                    args.free_var_repeats if case == "free_var_search" else args.repeats
+                )
+                for n in ns:
+                    result = {
+                        "size": size,
+                        "case": case,
+                        "n": n,
+                        **run_isolated(case, path, size, n, repeats, args.seed),
+                    }
+                    print(json.dumps(result), flush=True)
+                    results.append(result)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    meta = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "build_seconds": builds,
+    }
+    with open(args.out, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"- Wrote {len(results)} results to {args.out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        sys.exit(1 if regressions else 0)
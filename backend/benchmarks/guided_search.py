@@ -0,0 +1,74 @@
+"""
+Hits per second of the free variable search with random (B, C) sampling versus the
+guided neighbourhood grid, on the same queries and the same number of equations. A
+hit is an equation whose D is above the similarity threshold. Prints one JSON line
+per mode.
+
+    python benchmarks/guided_search.py --data embeddings --queries 20 --n 4096
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.store import load_BCV_store  # noqa: E402
+from core.ann import load_ann_index  # noqa: E402
+from core.search import iter_free_var_search, concat_results  # noqa: E402
+from core.sampling import sample_pairs  # noqa: E402
+from core.guided import guided_candidates, grid_pairs  # noqa: E402
+from core.guided import NEIGHBOURHOOD_SIZE  # noqa: E402
+
+
+def run_mode(make_pairs, q_indices, normed, norms, sim_threshold: float):
+    equations, hits, elapsed = 0, 0, 0.0
+    for q_index in q_indices:
+        start = time.perf_counter()
+        # choosing the pairs is part of the cost, the neighbourhood search especially
+        pairs = make_pairs(q_index)
+        d_sims, *_ = concat_results(
+            iter_free_var_search(q_index, normed, norms, pairs, sim_threshold)
+        )
+        elapsed += time.perf_counter() - start
+        equations += len(pairs[0])
+        hits += len(d_sims)
+    return {
+        "queries": len(q_indices),
+        "equations": equations,
+        "hits": hits,
+        "seconds": elapsed,
+        "hits_per_sec": hits / elapsed,
+        "hits_per_1k_equations": 1000 * hits / max(equations, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default="embeddings")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--n", type=int, default=4_096)
+    parser.add_argument("--sim-threshold", type=float, default=0.80)
+    parser.add_argument("--neighbourhood-size", type=int, default=NEIGHBOURHOOD_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    normed, norms = load_BCV_store(args.data)
+    ann_index = load_ann_index(args.data)
+    rng = np.random.default_rng(args.seed)
+    q_indices = rng.choice(len(normed), size=args.queries, replace=False)
+
+    modes = {
+        "random": lambda q_index: sample_pairs(len(normed), args.n, args.seed),
+        "guided": lambda q_index: grid_pairs(
+            guided_candidates(
+                q_index, [], normed, args.neighbourhood_size, ann_index
+            ),
+            args.n,
+            args.seed,
+        ),
+    }
+    for name, make_pairs in modes.items():
+        result = run_mode(make_pairs, q_indices, normed, norms, args.sim_threshold)
+        print(json.dumps({"mode": name, **result}))
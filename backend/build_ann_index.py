@@ -0,0 +1,44 @@
+import json
+import time
+import numpy as np
+from core.store import load_BCV_store, BCV_rows
+from core.ann import build_ann_index, save_ann_index, recall_report
+from core.ann import ANN_FILE, BERT_ANN_FILE
+from core.manifest import write_manifest
+
+N_RECALL_QUERIES = 1_000
+
+BCV_normed, BCV_norms = load_BCV_store("embeddings")
+BERT_embeddings = np.load("embeddings/BERT_embeddings.npy", mmap_mode="r")
+print(f"BCV_normed: {BCV_normed.shape}")
+print(f"BERT_embeddings: {BERT_embeddings.shape}")
+
+print("Building BERT ANN index...", end=" ", flush=True)
+start = time.time()
+BERT_index = build_ann_index(BERT_embeddings)
+print(f"Done in {time.time() - start} seconds")
+save_ann_index("embeddings", BERT_index, BERT_ANN_FILE)
+
+print("Building BCV ANN index...", end=" ", flush=True)
+start = time.time()
+index = build_ann_index(BCV_normed)
+print(f"Done in {time.time() - start} seconds")
+save_ann_index("embeddings", index)
+write_manifest("embeddings", [ANN_FILE, BERT_ANN_FILE])
+
+# recall is measured on analogy-style queries (A + B - C), which is what
+# compute_expression sends, rather than on the indexed rows themselves
+rng = np.random.default_rng(0)
+terms = rng.choice(len(BCV_normed), size=(N_RECALL_QUERIES, 3))
+queries = (
+    BCV_rows(BCV_normed, BCV_norms, terms[:, 0])
+    + BCV_rows(BCV_normed, BCV_norms, terms[:, 1])
+    - BCV_rows(BCV_normed, BCV_norms, terms[:, 2])
+)
+for k in (1, 10, 50):
+    print("BCV", json.dumps(recall_report(index, BCV_normed, queries, k=k)))
+
+BERT_queries = BERT_embeddings[rng.choice(len(BERT_embeddings), size=N_RECALL_QUERIES)]
+BERT_queries = BERT_queries + rng.normal(scale=0.01, size=BERT_queries.shape)
+for k in (1, 10):
+    print("BERT", json.dumps(recall_report(BERT_index, BERT_embeddings, BERT_queries, k=k)))
@@ -0,0 +1,24 @@
+import time
+import numpy as np
+from core.store import load_BCV_store
+from core.search import top_k_cosine
+from core.knn import build_knn_graph, KNN_INDICES_FILE, KNN_SCORES_FILE
+from core.manifest import write_manifest
+
+N_CHECK_ROWS = 100
+
+BCV_normed, _ = load_BCV_store("embeddings")
+print(f"BCV_normed: {BCV_normed.shape}")
+
+print("Building BCV k-NN graph...", end=" ", flush=True)
+start = time.time()
+indices, scores = build_knn_graph("embeddings", BCV_normed)
+print(f"Done in {time.time() - start} seconds")
+write_manifest("embeddings", [KNN_INDICES_FILE, KNN_SCORES_FILE])
+
+# spot check a few rows against a fresh scan; the scores only differ by float16 rounding
+rows = np.random.default_rng(0).choice(len(BCV_normed), size=N_CHECK_ROWS)
+exact, exact_sims = top_k_cosine(BCV_normed[rows], BCV_normed, indices.shape[1] + 1)
+hits = [len(np.intersect1d(e, i)) for e, i in zip(exact, indices[rows])]
+print(f"Neighbours found by a fresh scan: {np.sum(hits) / indices[rows].size}")
+print(f"Max score error: {np.abs(exact_sims[:, 1:] - scores[rows]).max()}")
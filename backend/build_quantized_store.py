@@ -0,0 +1,33 @@
+import sys
+import json
+import time
+import numpy as np
+from core.store import load_BCV_store, BCV_rows
+from core.quantize import write_quantized_store, quantization_report
+from core.quantize import QUANTIZED_FILE, SCALES_FILE
+from core.manifest import write_manifest
+
+# Usage: python build_quantized_store.py [int8|float16]
+
+N_REPORT_QUERIES = 1_000
+
+dtype = sys.argv[1] if len(sys.argv) > 1 else "int8"
+BCV_normed, BCV_norms = load_BCV_store("embeddings")
+print(f"BCV_normed: {BCV_normed.shape}")
+
+print(f"Writing {dtype} BCV store...", end=" ", flush=True)
+start = time.time()
+quantized = write_quantized_store("embeddings", BCV_normed, dtype)
+print(f"Done in {time.time() - start} seconds")
+write_manifest("embeddings", [QUANTIZED_FILE, SCALES_FILE])
+
+# same analogy-style queries (A + B - C) as the ANN recall report
+rng = np.random.default_rng(0)
+terms = rng.choice(len(BCV_normed), size=(N_REPORT_QUERIES, 3))
+queries = (
+    BCV_rows(BCV_normed, BCV_norms, terms[:, 0])
+    + BCV_rows(BCV_normed, BCV_norms, terms[:, 1])
+    - BCV_rows(BCV_normed, BCV_norms, terms[:, 2])
+)
+for k in (1, 4, 10, 50):
+    print("BCV", json.dumps(quantization_report(quantized, BCV_normed, queries, k=k)))
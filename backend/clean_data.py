@@ -1,11 +1,124 @@
-import json
+import os
+import sys
 import pickle
 import numpy as np
+from core.glove import iter_glove_json, scan_glove_json
+from core.store import (
+    write_BCV_store,
+    update_BCV_store,
+    write_normalized,
+    save_BCV_lookup,
+    LIST_FILE,
+    NORMED_FILE,
+    NORMS_FILE,
+    LIST_ORDER_FILE,
+)
+from core.suggest import build_suggest_index, save_suggest_index, SUGGEST_FILES
+from core.descriptions import (
+    save_description_store,
+    load_description_store,
+    changed_description_rows,
+    BLOB_FILE,
+    OFFSETS_FILE,
+)
+from core.quantize import update_quantized_rows, QUANTIZED_FILE, SCALES_FILE
+from core.knn import KNN_INDICES_FILE, KNN_SCORES_FILE
+from core.ann import ANN_FILE, BERT_ANN_FILE
+from core.manifest import write_manifest
 
+# Every array is streamed into a preallocated .npy on disk instead of being built
+# in memory first, so peak RAM stays around one block plus the descriptions dict.
+#
+# python clean_data.py --incremental only rewrites what changed since the last run:
+# BCV rows whose concept or vector differs are updated in place and appended concepts
+# grow the files (everything is rebuilt if concepts were removed or the dimension
+# changed, and the quantized store is deleted; otherwise it is updated the same way),
+# the ANN index and k-NN graph are deleted if any row changed, the
+# description store and suggest index are only rebuilt if a concept or description
+# changed, and the BERT arrays are kept if they exist.
+
+GLOVE_PATH = "unprocessed/concept_glove.json"
+SENTENCES_PATH = "unprocessed/sentences.txt"
+INCREMENTAL = "--incremental" in sys.argv
+
+written = []
+removed = []
+# scripts to rerun for derived artifacts that no longer match their source
+rebuild = set()
+
+
+def remove_stale(script: str, *filenames: str):
+    """Deletes derived files that would no longer match, so nothing loads them."""
+    for filename in filenames:
+        if os.path.exists(os.path.join("embeddings", filename)):
+            os.remove(os.path.join("embeddings", filename))
+            removed.append(filename)
+            rebuild.add(script)
+
+
+# BCVs: two passes over the JSON, one to size the outputs and one to fill them
+n, dim, key_len = scan_glove_json(GLOVE_PATH)
+updated = None
+if INCREMENTAL:
+    updated = update_BCV_store(
+        "embeddings", iter_glove_json(GLOVE_PATH), n, dim, key_len
+    )
+if updated is None:
+    BCV_list, BCV_normed, BCV_norms = write_BCV_store(
+        "embeddings", iter_glove_json(GLOVE_PATH), n, dim, key_len
+    )
+    changed_rows, renamed_rows = np.arange(n), np.arange(n)
+else:
+    BCV_list, BCV_normed, BCV_norms, changed_rows, renamed_rows = updated
+print(f"BCV rows rewritten: {len(changed_rows)} of {n}")
+if updated is None:
+    # the rows may have moved or changed shape, so nothing derived from them holds
+    remove_stale("build_quantized_store.py", QUANTIZED_FILE, SCALES_FILE)
+    remove_stale("build_ann_index.py", ANN_FILE)
+    remove_stale("build_knn_graph.py", KNN_INDICES_FILE, KNN_SCORES_FILE)
+elif len(changed_rows) > 0:
+    if update_quantized_rows("embeddings", BCV_normed, changed_rows):
+        written += [QUANTIZED_FILE, SCALES_FILE]
+    else:
+        remove_stale("build_quantized_store.py", QUANTIZED_FILE, SCALES_FILE)
+    # a changed row moves its own neighbours and may enter any other row's, so these
+    # can't be patched per row, and serving them would return neighbours of the old
+    # vectors (or old concepts, for renamed rows)
+    remove_stale("build_ann_index.py", ANN_FILE)
+    remove_stale("build_knn_graph.py", KNN_INDICES_FILE, KNN_SCORES_FILE)
+if len(changed_rows) > 0:
+    written += [NORMED_FILE, NORMS_FILE]
+if len(renamed_rows) > 0:
+    save_BCV_lookup("embeddings", BCV_list)
+    written += [LIST_FILE, LIST_ORDER_FILE]
+
+if not (INCREMENTAL and os.path.exists("embeddings/BERT_sentences.npy")):
+    # bert_query only ever compares by cosine, so store the embeddings pre-normalized
+    write_normalized(
+        np.load("unprocessed/description_embeddings.npy", "r"),
+        "embeddings/BERT_embeddings.npy",
+    )
+
+    with open(SENTENCES_PATH, "r") as f:
+        n_sentences, sentence_len = 0, 0
+        for line in f:
+            n_sentences += 1
+            sentence_len = max(sentence_len, len(line))
+    BERT_sentences = np.lib.format.open_memmap(
+        "embeddings/BERT_sentences.npy",
+        mode="w+",
+        dtype=f"<U{sentence_len}",
+        shape=(n_sentences,),
+    )
+    with open(SENTENCES_PATH, "r") as f:
+        for i, line in enumerate(f):
+            BERT_sentences[i] = line
+    BERT_sentences.flush()
+    written += ["BERT_embeddings.npy", "BERT_sentences.npy"]
+    remove_stale("build_ann_index.py", BERT_ANN_FILE)
+BERT_embeddings = np.load("embeddings/BERT_embeddings.npy", mmap_mode="r")
+BERT_sentences = np.load("embeddings/BERT_sentences.npy", mmap_mode="r")
 
-BCVs = json.load(open("unprocessed/concept_glove.json", "r"))
-BERT_sentences = np.array(open("unprocessed/sentences.txt", "r").readlines(), dtype=str)
-BERT_embeddings = np.load("unprocessed/description_embeddings.npy", "r")
 BCV_descriptions = pickle.load(open("unprocessed/concept_descriptions.pkl", "rb"))
 
 temp = {}
@@ -25,24 +138,35 @@ for key, value in BCV_descriptions.items():
         for v in value:
             rev_BCV_descriptions[v] = key
 
-
-BCV_list = np.array(list(BCVs.keys()), dtype=str)
-BCV_values = np.array(list(BCVs.values()), dtype=np.float32)
-BCVs = {BCV_list[i]: np.array(BCV_values[i]) for i in range(len(BCV_list))}
-
-print(f"BCVs: {len(BCVs)}")
 print(f"BCV_list: {BCV_list.shape}")
-print(f"BCV_values: {BCV_values.shape}")
+print(f"BCV_normed: {BCV_normed.shape}")
 print(f"BERT_sentences: {BERT_sentences.shape}")
 print(f"BERT_embeddings: {BERT_embeddings.shape}")
 print(f"BCV_descriptions: {len(BCV_descriptions)}")
 print(f"rev_BCV_descriptions: {len(rev_BCV_descriptions)}")
 
+# the blob is contiguous, so a changed description means rewriting the (text only)
+# store, but an unchanged vocabulary and descriptions skip it altogether
+if INCREMENTAL and os.path.exists(f"embeddings/{OFFSETS_FILE}"):
+    changed_descriptions = changed_description_rows(
+        load_description_store("embeddings"), BCV_list, BCV_descriptions
+    )
+else:
+    changed_descriptions = np.arange(len(BCV_list))
+print(f"Descriptions changed: {len(changed_descriptions)} of {len(BCV_list)}")
+# an index from before the first-word keys were split out is rebuilt regardless
+stale_suggest_index = not all(
+    os.path.exists(os.path.join("embeddings", filename)) for filename in SUGGEST_FILES
+)
+if len(changed_descriptions) > 0 or len(renamed_rows) > 0 or stale_suggest_index:
+    save_description_store("embeddings", BCV_list, BCV_descriptions)
+    np.save("embeddings/rev_BCV_descriptions.npy", rev_BCV_descriptions)
+    save_suggest_index("embeddings", build_suggest_index(BCV_list, BCV_descriptions))
+    written += [BLOB_FILE, OFFSETS_FILE, "rev_BCV_descriptions.npy", *SUGGEST_FILES]
 
-np.save("embeddings/BCVs.npy", BCVs)
-np.save("embeddings/BCV_values.npy", BCV_values)
-np.save("embeddings/BERT_embeddings.npy", BERT_embeddings)
-np.save("embeddings/BCV_list.npy", BCV_list)
-np.save("embeddings/BERT_sentences.npy", BERT_sentences)
-np.save("embeddings/BCV_descriptions.npy", BCV_descriptions)
-np.save("embeddings/rev_BCV_descriptions.npy", rev_BCV_descriptions)
+manifest = write_manifest("embeddings", written, removed)
+for filename in written:
+    entry = manifest[filename]
+    print(f"{filename}: {entry.get('shape')} {entry.get('dtype')} {entry['sha256']}")
+if rebuild:
+    print(f"Derived artifacts are stale, rerun: {', '.join(sorted(rebuild))}")
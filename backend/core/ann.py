@@ -0,0 +1,76 @@
+"""
+Approximate nearest neighbour indexes over the normalized BCV store and BERT embeddings.
+
+The indexes are HNSW graphs with inner product as their metric, so on L2-normalized
+rows their scores are cosine similarities. They are built once offline by
+build_ann_index.py, written next to the matrices they index and loaded at startup.
+"""
+import os
+import time
+import faiss
+import numpy as np
+from core.store import normalize_rows
+from core.search import top_k_cosine, empty_top_k
+
+ANN_FILE = "BCV_ann.index"
+BERT_ANN_FILE = "BERT_embeddings.index"
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+
+
+def build_ann_index(normed: np.ndarray, M: int = HNSW_M):
+    index = faiss.IndexHNSWFlat(normed.shape[1], M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.add(np.ascontiguousarray(normed, dtype=np.float32))
+    return index
+
+
+def save_ann_index(path: str, index, filename: str = ANN_FILE):
+    faiss.write_index(index, os.path.join(path, filename))
+
+
+def load_ann_index(path: str, filename: str = ANN_FILE, shape: tuple = None):
+    """
+    Returns the persisted index, or None if it hasn't been built yet or, when the
+    indexed matrix's shape is given, was built for a matrix of another shape.
+    """
+    index_path = os.path.join(path, filename)
+    if not os.path.exists(index_path):
+        return None
+    index = faiss.read_index(index_path)
+    if shape is not None and (index.ntotal, index.d) != tuple(shape):
+        print(f"- Ignoring {filename} of shape {(index.ntotal, index.d)}, not {shape}")
+        return None
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def ann_top_k(index, vectors: np.ndarray, k: int):
+    """Same contract as search.top_k_cosine: (indices, sims), sorted descending."""
+    vectors_normed, _ = normalize_rows(np.atleast_2d(vectors))
+    if k <= 0:
+        return empty_top_k(len(vectors_normed))
+    top_sims, top = index.search(vectors_normed, k)
+    return top, top_sims
+
+
+def recall_report(index, normed: np.ndarray, queries: np.ndarray, k: int = 10):
+    """Compares the index against brute force search for the given query vectors."""
+    start = time.time()
+    exact, _ = top_k_cosine(queries, normed, k)
+    exact_time = time.time() - start
+
+    start = time.time()
+    approx, _ = ann_top_k(index, queries, k)
+    approx_time = time.time() - start
+
+    hits = [len(np.intersect1d(e, a)) for e, a in zip(exact, approx)]
+    return {
+        "k": k,
+        "queries": len(queries),
+        f"recall@{k}": float(np.sum(hits) / (k * len(queries))),
+        "exact_ms_per_query": 1000 * exact_time / len(queries),
+        "ann_ms_per_query": 1000 * approx_time / len(queries),
+    }
@@ -0,0 +1,89 @@
+"""
+Micro-batching and caching for sentence embedding requests.
+
+Concurrent callers of EncodeBatcher.encode are coalesced by a background thread: it
+waits up to max_wait seconds (or until max_batch_size texts are queued) and then runs
+one model.encode over the whole batch. Results are kept in an LRU cache, since
+autocomplete sends the same prefixes over and over.
+"""
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+MAX_BATCH_SIZE = 32
+MAX_WAIT = 0.005
+CACHE_SIZE = 4_096
+
+
+class EncodeBatcher:
+    def __init__(
+        self,
+        encode,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT,
+        cache_size: int = CACHE_SIZE,
+    ):
+        """encode takes a list of texts and returns one embedding row per text."""
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def encode(self, text: str):
+        """Embedding of a single text; blocks until its batch has been encoded."""
+        with self.cache_lock:
+            if text in self.cache:
+                self.cache.move_to_end(text)
+                self.hits += 1
+                return self.cache[text]
+            self.misses += 1
+
+        future = Future()
+        self.queue.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: list):
+        # identical texts in one batch are only encoded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = dict(zip(texts, self._encode(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        with self.cache_lock:
+            for text, embedding in embeddings.items():
+                self.cache[text] = embedding
+                self.cache.move_to_end(text)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        for text, future in batch:
+            future.set_result(embeddings[text])
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "batches": self.batches}
@@ -0,0 +1,196 @@
+"""
+Persistent, content-addressed cache for GPT rationales.
+
+Entries are keyed on a sha256 of (model, prompt messages), and the prompt messages
+embed the equation, so identical requests share one answer across requests and
+containers. Entries expire after a TTL, and the least recently used ones are
+evicted once the cache holds more than max_entries.
+
+SQLite locking isn't reliable on a network file system such as a Modal shared volume,
+so containers never write to a common database. open_shared_cache gives each
+container its own database in the shared directory, which only it writes, and copies
+in the unexpired entries of every other container's database (opened read-only) when
+it starts. A live container touches its database every HEARTBEAT_INTERVAL, so one
+untouched for DEAD_AFTER belongs to a container that has stopped; once its entries
+are merged into the new container's database it is deleted, and the directory holds
+about one database per live container instead of one per container ever started.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from core.metrics import metrics, INSTANCE
+
+TTL_SECONDS = 30 * 24 * 60 * 60
+MAX_ENTRIES = 100_000
+HEARTBEAT_INTERVAL = 5 * 60.0
+DEAD_AFTER = 3 * HEARTBEAT_INTERVAL
+
+
+def rationale_key(model: str, messages: list):
+    payload = json.dumps([model, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RationaleCache:
+    def __init__(
+        self,
+        path: str,
+        ttl: float = TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS rationales (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS rationales_last_used ON rationales (last_used)"
+        )
+        self.db.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value, created FROM rationales WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.db.execute("DELETE FROM rationales WHERE key = ?", (key,))
+                    self.db.commit()
+                self.misses += 1
+                metrics.inc("rationale_cache_misses")
+                return None
+            self.db.execute(
+                "UPDATE rationales SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.db.commit()
+            self.hits += 1
+            metrics.inc("rationale_cache_hits")
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO rationales VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self.evict(now)
+            self.db.commit()
+
+    def merge(self, path: str):
+        """
+        Copies the unexpired entries of the database at path that this one lacks.
+        Returns how many, or None if the database couldn't be read.
+        """
+        now = time.time()
+        other = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = other.execute(
+                "SELECT key, value, created, last_used FROM rationales WHERE created >= ?",
+                (now - self.ttl,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            # e.g. a database its container is still creating
+            print(f"- Skipping rationale cache {path}: {e!r}")
+            return None
+        finally:
+            other.close()
+        with self.lock:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO rationales VALUES (?, ?, ?, ?)", rows
+            )
+            merged = self.db.total_changes - before
+            self.evict(now)
+            self.db.commit()
+        return merged
+
+    def evict(self, now: float):
+        """Drops expired entries, then least recently used ones down to max_entries."""
+        self.db.execute("DELETE FROM rationales WHERE created < ?", (now - self.ttl,))
+        self.db.execute(
+            """DELETE FROM rationales WHERE key IN (
+                SELECT key FROM rationales ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM rationales").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+def open_shared_cache(directory: str, ttl: float = TTL_SECONDS, **kwargs):
+    """
+    This container's RationaleCache in directory, shared by several containers,
+    seeded with the entries of the other containers' databases there.
+    """
+    os.makedirs(directory, exist_ok=True)
+    own = os.path.join(directory, f"{INSTANCE}.sqlite")
+    others, dead = [], set()
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if not filename.endswith(".sqlite") or path == own:
+            continue
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > ttl:
+                os.remove(path)
+                continue
+            others.append(path)
+            if age > DEAD_AFTER:
+                dead.add(path)
+        except FileNotFoundError:
+            # another container pruned it first
+            pass
+
+    cache = RationaleCache(own, ttl=ttl, **kwargs)
+    merged, pruned = 0, 0
+    for path in others:
+        count = cache.merge(path)
+        if count is None:
+            continue
+        merged += count
+        if path in dead:
+            # its entries now live on in this container's database
+            remove_if_exists(path)
+            pruned += 1
+    print(
+        f"- Rationale cache: merged {merged} entries from {len(others)} containers, "
+        f"pruned {pruned} stopped ones"
+    )
+    threading.Thread(target=heartbeat, args=(own,), daemon=True).start()
+    return cache
+
+
+def heartbeat(path: str, interval: float = HEARTBEAT_INTERVAL):
+    """Touches path every interval, so other containers know its owner is alive."""
+    while True:
+        time.sleep(interval)
+        try:
+            os.utime(path)
+        except OSError as e:
+            print(f"- Rationale cache heartbeat failed: {e!r}")
+
+
+def remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # another container pruned it first
+        pass
@@ -2,6 +2,7 @@ import openai
 import dotenv
 import os
 from enum import Enum
+from core.cache import rationale_key
 
 
 class GPTVersion(str, Enum):
@@ -13,6 +14,8 @@ class GPTVersion(str, Enum):
 def load_openai_key(path):
     dotenv.load_dotenv(path)
     openai.api_key = os.getenv("OPENAI_API_KEY")
+    # e.g. a local mock server during development
+    openai.api_base = os.getenv("OPENAI_API_BASE", openai.api_base)
 
 
 def build_message_list_explain_equation(query: str):
@@ -63,9 +66,19 @@ def build_message_list_explain_equation(query: str):
     ]
 
 
-def gpt_rationale(query: str, gpt_version: GPTVersion):
+def gpt_rationale(query: str, gpt_version: GPTVersion, cache=None):
+    messages = build_message_list_explain_equation(query)
+    if cache is not None:
+        key = rationale_key(gpt_version.value, messages)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     completion = openai.ChatCompletion.create(
-        model=gpt_version.value, messages=build_message_list_explain_equation(query)
+        model=gpt_version.value, messages=messages
     )
     feature_string = completion.choices[0].message.content
+    if cache is not None:
+        cache.put(key, feature_string)
     return feature_string
+
@@ -0,0 +1,61 @@
+"""
+Row-aligned concept description store.
+
+Descriptions are stored in BCV_list order as one UTF-8 blob plus an offsets array
+(row i is blob[offsets[i]:offsets[i + 1]]). Both are memory-mapped, and a row is only
+decoded when it is actually returned, so nothing is unpickled at startup.
+"""
+import os
+import numpy as np
+
+BLOB_FILE = "BCV_description_blob.npy"
+OFFSETS_FILE = "BCV_description_offsets.npy"
+
+
+def description_text(description):
+    """Flattens a raw description (str, list of alternatives or None) to one string."""
+    if description is None:
+        return ""
+    if isinstance(description, list):
+        return " or ".join(description)
+    return description
+
+
+def save_description_store(path: str, BCV_list: np.ndarray, BCV_descriptions: dict):
+    encoded = [
+        description_text(BCV_descriptions.get(concept)).encode() for concept in BCV_list
+    ]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    np.save(os.path.join(path, BLOB_FILE), np.frombuffer(b"".join(encoded), np.uint8))
+    np.save(os.path.join(path, OFFSETS_FILE), offsets)
+
+
+def load_description_store(path: str):
+    return (
+        np.load(os.path.join(path, BLOB_FILE), mmap_mode="r"),
+        np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r"),
+    )
+
+
+def description_at(store, row: int):
+    """Decodes one row's description, or returns None if the concept has none."""
+    blob, offsets = store
+    start, end = offsets[row], offsets[row + 1]
+    if start == end:
+        return None
+    return bytes(blob[start:end]).decode()
+
+
+def changed_description_rows(store, BCV_list: np.ndarray, BCV_descriptions: dict):
+    """Rows whose description in the store differs from the one in BCV_descriptions."""
+    blob, offsets = store
+    if len(offsets) != len(BCV_list) + 1:
+        return np.arange(len(BCV_list))
+    changed = [
+        row
+        for row, concept in enumerate(BCV_list)
+        if description_text(BCV_descriptions.get(concept)).encode()
+        != bytes(blob[offsets[row] : offsets[row + 1]])
+    ]
+    return np.array(changed, dtype=np.int64)
@@ -0,0 +1,241 @@
+"""
+The bodies of the web endpoints in main.py, without the Modal and FastAPI wrapping.
+
+Each function takes resources, a namespace with the loaded resources under the names
+core.init gives them (main.py passes core.init itself), and only reads the ones it
+documents, so the endpoints and benchmarks/endpoints.py run the same code. Loading
+them with require() is left to the caller.
+"""
+import numpy as np
+import pandas as pd
+from core.store import BCV_rows, BCV_index_of
+from core.search import (
+    EQUATION_BLOCK_SIZE,
+    iter_free_var_search,
+    concat_results,
+    top_k_cosine,
+    top_k_quantized,
+)
+from core.ann import ann_top_k
+from core.expression import parse_expression
+from core.suggest import suggest_rows
+from core.descriptions import description_at
+from core.knn import knn_neighbours
+from core.sampling import sample_pairs, sample_stratified_pairs
+from core.guided import guided_candidates, grid_pairs, NEIGHBOURHOOD_SIZE
+from core.metrics import metrics
+
+
+def bert_matches(resources, query_vector: np.ndarray, top_k: int) -> list:
+    """
+    (sentence, similarity) of the top_k BERT sentences for an encoded query. Reads
+    BERT_embeddings, BERT_ann_index and BERT_sentences.
+    """
+    with metrics.span("search"):
+        if resources.BERT_ann_index is None:
+            indices, sims = top_k_cosine(query_vector, resources.BERT_embeddings, top_k)
+        else:
+            indices, sims = ann_top_k(resources.BERT_ann_index, query_vector, top_k)
+    return [
+        (resources.BERT_sentences[i].strip("\n"), float(sim))
+        for i, sim in zip(indices[0], sims[0])
+    ]
+
+
+def suggest_concepts(resources, query: str, limit: int) -> list:
+    """
+    (description, concept) of up to limit concepts whose description has a word
+    starting with query. Reads BCV_list, BCV_descriptions and BCV_suggest_index.
+    """
+    with metrics.span("search"):
+        rows = suggest_rows(resources.BCV_suggest_index, query, limit)
+    with metrics.span("map"):
+        return [(row_description(resources, i), resources.BCV_list[i]) for i in rows]
+
+
+def BCV_index(resources, query: str):
+    """Row of the concept query in the store, or None. Reads BCV_list."""
+    return BCV_index_of(resources.BCV_list, resources.BCV_list_order, query)
+
+
+def BCV_vector(resources, query: str) -> np.ndarray:
+    """The vector of the concept query; raises ValueError if it isn't in the store."""
+    query_index = BCV_index(resources, query)
+    if query_index is None:
+        raise ValueError(f"Concept {query} not found in BioConceptVectors.")
+    return BCV_rows(resources.BCV_normed, resources.BCV_norms, query_index)
+
+
+def expression_vector(resources, expression: list) -> np.ndarray:
+    """
+    The vector of an expression like ["A", "+", "B", "-", "C"]; raises ValueError if
+    it is malformed or names a concept that isn't in the store. Reads BCV_list and
+    BCV_store.
+    """
+    result = np.zeros(resources.BCV_normed.shape[1], dtype=np.float32)
+    for sign, concept in parse_expression(expression):
+        result += sign * BCV_vector(resources, concept)
+    return result
+
+
+def top_BCV_matches(resources, vectors: np.ndarray, k: int, exact: bool = False) -> list:
+    """
+    Top k concepts by cosine similarity to each vector, as one {concept: similarity}
+    dict per vector. Uses the ANN index when one was built for the store, else the
+    quantized scan if there is a quantized copy, unless exact=True forces a float32
+    brute force scan. Reads BCV_list, BCV_store, BCV_ann_index and BCV_quantized.
+    """
+    if exact:
+        with metrics.span("cosine"):
+            top, top_sims = top_k_cosine(vectors, resources.BCV_normed, k)
+    elif resources.BCV_ann_index is not None:
+        with metrics.span("ann"):
+            top, top_sims = ann_top_k(resources.BCV_ann_index, vectors, k)
+    elif resources.BCV_quantized is not None:
+        with metrics.span("quantized"):
+            top, top_sims = top_k_quantized(
+                vectors, resources.BCV_quantized, resources.BCV_normed, k
+            )
+    else:
+        with metrics.span("cosine"):
+            top, top_sims = top_k_cosine(vectors, resources.BCV_normed, k)
+    with metrics.span("map"):
+        return [
+            {resources.BCV_list[i]: float(sim) for i, sim in zip(row, row_sims)}
+            for row, row_sims in zip(top, top_sims)
+        ]
+
+
+def graph_similar_concepts(resources, concept_index: int, k: int):
+    """
+    {concept: similarity} of the concept and its top k - 1 neighbours from the k-NN
+    graph, or None if there is no graph or it holds fewer neighbours per concept.
+    Reads BCV_list and BCV_knn_graph.
+    """
+    graph = resources.BCV_knn_graph
+    # the concept itself is always its top match, and the graph leaves it out
+    if graph is None or k - 1 > graph[0].shape[1]:
+        return None
+    with metrics.span("knn_graph"):
+        indices, scores = knn_neighbours(graph, concept_index, max(k - 1, 0))
+    similar = {resources.BCV_list[concept_index]: 1.0} if k > 0 else {}
+    similar.update(
+        (resources.BCV_list[i], float(score)) for i, score in zip(indices, scores)
+    )
+    return similar
+
+
+def row_description(resources, index: int) -> str:
+    """Description of the concept in row index, or "N/A". Reads BCV_descriptions."""
+    mapped = description_at(resources.BCV_descriptions, index)
+    return "N/A" if mapped is None else mapped
+
+
+def free_var_pairs(
+    resources,
+    q_index: int,
+    n: int,
+    seed: int = None,
+    stratify: bool = False,
+    guided: bool = False,
+    anchors: list = None,
+    neighbourhood_size: int = NEIGHBOURHOOD_SIZE,
+):
+    """
+    Up to n distinct (B, C) pairs for the free variable search. With guided=True they
+    are the grid over the neighbourhoods of the query and the anchor concepts (see
+    core.guided), otherwise random pairs from the whole store. With stratify=True,
+    random B and C are of the same concept type and spread evenly over the types.
+    Reads BCV_list, plus BCV_store, BCV_ann_index and BCV_knn_graph if guided, or
+    BCV_types if stratify. Raises ValueError for an anchor that isn't in the store.
+    """
+    if guided:
+        anchor_indices = []
+        for anchor in anchors or []:
+            anchor_index = BCV_index(resources, anchor)
+            if anchor_index is None:
+                raise ValueError(f"Anchor {anchor} not found in BioConceptVectors.")
+            anchor_indices.append(anchor_index)
+        candidates = guided_candidates(
+            q_index,
+            anchor_indices,
+            resources.BCV_normed,
+            neighbourhood_size,
+            resources.BCV_ann_index,
+            resources.BCV_knn_graph,
+        )
+        return grid_pairs(candidates, n, seed)
+    if stratify:
+        return sample_stratified_pairs(resources.BCV_types, n, seed)
+    return sample_pairs(len(resources.BCV_list), n, seed)
+
+
+def iter_free_var_blocks(
+    resources,
+    q_index: int,
+    pairs,
+    sim_threshold: float,
+    block_size: int = EQUATION_BLOCK_SIZE,
+):
+    """
+    core.search.iter_free_var_search over the store, with the quantized copy if there
+    is one. Reads BCV_store and BCV_quantized.
+    """
+    return iter_free_var_search(
+        q_index,
+        resources.BCV_normed,
+        resources.BCV_norms,
+        pairs,
+        sim_threshold,
+        block_size=block_size,
+        quantized=resources.BCV_quantized,
+    )
+
+
+def free_var_results(
+    resources,
+    q_index: int,
+    pairs,
+    sim_threshold: float,
+    block_size: int = EQUATION_BLOCK_SIZE,
+):
+    """(d_sims, b_indices, c_indices, d_indices) of every row above sim_threshold."""
+    with metrics.span("search"):
+        return concat_results(
+            iter_free_var_blocks(resources, q_index, pairs, sim_threshold, block_size)
+        )
+
+
+def free_var_frame(
+    resources, q: str, q_index: int, d_sims, b_indices, c_indices, d_indices
+):
+    """
+    Builds the results dataframe for the given rows, mapping only those rows. Reads
+    BCV_list and BCV_descriptions.
+    """
+    q_mapped = row_description(resources, q_index)
+    bs = resources.BCV_list[b_indices]
+    cs = resources.BCV_list[c_indices]
+    ds = resources.BCV_list[d_indices]
+    b_mapped = [row_description(resources, i) for i in b_indices]
+    c_mapped = [row_description(resources, i) for i in c_indices]
+    d_mapped = [row_description(resources, i) for i in d_indices]
+
+    return pd.DataFrame(
+        {
+            "Equation": [f"({q}) + ({b}) - ({c}) = ({d})" for b, c, d in zip(bs, cs, ds)],
+            "Q": q,
+            "B": bs,
+            "C": cs,
+            "D": ds,
+            "Equation (Mapped)": [
+                f"{q} (aka {q_mapped}) + {b} (aka {bm}) - {c} (aka {cm}) = {d} (aka {dm})"
+                for b, c, d, bm, cm, dm in zip(bs, cs, ds, b_mapped, c_mapped, d_mapped)
+            ],
+            "Q (Mapped)": q_mapped,
+            "B (Mapped)": b_mapped,
+            "C (Mapped)": c_mapped,
+            "D (Mapped)": d_mapped,
+            "Similarity": np.asarray(d_sims, dtype=float),
+        }
+    )
@@ -0,0 +1,53 @@
+"""
+Signed-term concept expressions, e.g. ["Species_9615", "+", "Chemical_MESH_D001194"]
+or ["-", "Gene_6406", "+", "Disease_MESH_D055752"].
+"""
+import numpy as np
+from scipy import sparse
+
+
+def parse_expression(expression: list):
+    """
+    Splits an expression into (sign, concept) pairs, where sign is +1 or -1. Raises
+    ValueError if it is empty or malformed.
+    """
+    if not expression:
+        raise ValueError("Empty expression")
+    if expression[0] != "-" and expression[0] != "+":
+        expression = ["+", *expression]
+
+    terms = []
+    for i in range(0, len(expression), 2):
+        if i + 1 == len(expression):
+            raise ValueError(f"Missing concept after operator: {expression[i]}")
+        sign, concept = expression[i : i + 2]
+        if sign == "+":
+            terms.append((1, concept))
+        elif sign == "-":
+            terms.append((-1, concept))
+        else:
+            raise ValueError(f"Invalid operator: {sign}")
+    return terms
+
+
+def expression_coefficients(expressions: list, get_index, norms: np.ndarray):
+    """
+    Builds the sparse (len(expressions), len(norms)) coefficient matrix for a batch of
+    expressions, so coefficients @ normed is every expression's result vector in one
+    product. Coefficients are scaled by the row norms because the store keeps
+    normalized rows. get_index maps a concept to its row, or None if it isn't stored.
+    """
+    rows, cols, values = [], [], []
+    for row, expression in enumerate(expressions):
+        for sign, concept in parse_expression(expression):
+            index = get_index(concept)
+            if index is None:
+                raise ValueError(f"Concept {concept} not found in BioConceptVectors.")
+            rows.append(row)
+            cols.append(index)
+            values.append(sign * norms[index])
+    # duplicate (row, col) entries are summed, so "A + A" counts A twice
+    return sparse.csr_matrix(
+        (np.asarray(values, dtype=np.float32), (rows, cols)),
+        shape=(len(expressions), len(norms)),
+    )
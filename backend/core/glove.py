@@ -0,0 +1,47 @@
+"""
+Streaming reader for concept_glove.json ({"concept": [floats], ...}).
+
+The file is decoded one entry at a time from a fixed-size buffer, so preprocessing
+never holds the full dict of float lists in memory.
+"""
+import re
+import json
+
+_decoder = json.JSONDecoder()
+_separators = re.compile(r"[\s,:]*")
+
+
+def iter_glove_json(path: str, chunk_size: int = 1 << 22):
+    """Yields (concept, vector) pairs in file order."""
+    with open(path) as f:
+        buffer = f.read(chunk_size)
+        pos = buffer.index("{") + 1
+        eof = False
+        while True:
+            pos = _separators.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "}":
+                return
+            try:
+                key, key_end = _decoder.raw_decode(buffer, pos)
+                value_start = _separators.match(buffer, key_end).end()
+                vector, pos = _decoder.raw_decode(buffer, value_start)
+            except json.JSONDecodeError:
+                # the entry straddles the end of the buffer, so read the next chunk
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield key, vector
+
+
+def scan_glove_json(path: str):
+    """Returns (n_concepts, dim, longest concept id) so outputs can be preallocated."""
+    n, dim, key_len = 0, 0, 0
+    for key, vector in iter_glove_json(path):
+        n += 1
+        dim = len(vector)
+        key_len = max(key_len, len(key))
+    return n, dim, key_len
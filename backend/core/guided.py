@@ -0,0 +1,72 @@
+"""
+Guided free variable search.
+
+Uniformly random (B, C) pairs rarely give an equation with a D above the similarity
+threshold. The guided mode instead takes B and C from the top M neighbourhoods of the
+query and of any other anchor concepts (read from the precomputed k-NN graph when
+there is one), and enumerates the whole B x C grid over those candidates (or a sample
+of it, if it is larger than the requested number of equations). The grid is fed to
+search.iter_free_var_search as ordinary pairs, so it is scored in the same blocked
+GEMMs against the store.
+"""
+import numpy as np
+from core.search import top_k_cosine
+from core.ann import ann_top_k
+from core.sampling import pair_at, sample_pairs
+from core.knn import knn_neighbours
+
+NEIGHBOURHOOD_SIZE = 64
+
+
+def neighbourhoods(
+    rows, normed: np.ndarray, M: int, ann_index=None, knn_graph=None
+):
+    """
+    Top M neighbours of each of the given rows, the row itself excluded. Read from the
+    precomputed k-NN graph when it is wide enough, else searched.
+    """
+    rows = np.atleast_1d(rows)
+    if knn_graph is not None and M <= knn_graph[0].shape[1]:
+        return [knn_neighbours(knn_graph, row, M)[0] for row in rows]
+    vectors = normed[rows]
+    if ann_index is None:
+        top, _ = top_k_cosine(vectors, normed, M + 1)
+    else:
+        top, _ = ann_top_k(ann_index, vectors, M + 1)
+    # HNSW pads with -1 when it finds fewer than M + 1 neighbours
+    return [
+        row_top[(row_top != row) & (row_top >= 0)][:M] for row, row_top in zip(rows, top)
+    ]
+
+
+def guided_candidates(
+    q_index: int,
+    anchor_indices,
+    normed: np.ndarray,
+    M: int = NEIGHBOURHOOD_SIZE,
+    ann_index=None,
+    knn_graph=None,
+):
+    """
+    Union of the neighbourhoods of the query and the anchors, plus the anchors
+    themselves, without the query. Sorted row indices.
+    """
+    anchors = np.unique(np.append(np.asarray(anchor_indices, dtype=np.int64), q_index))
+    neighbours = neighbourhoods(anchors, normed, M, ann_index, knn_graph)
+    candidates = np.unique(np.concatenate([anchors, *neighbours]))
+    return candidates[candidates != q_index]
+
+
+def grid_pairs(candidates: np.ndarray, n: int = None, seed=None):
+    """
+    Every (B, C) pair of distinct candidates in grid order, as (b_indices, c_indices).
+    If n is given and the grid has more than n pairs, n of them are sampled without
+    replacement instead.
+    """
+    m = len(candidates)
+    n_pairs = m * (m - 1)
+    if n is None or n >= n_pairs:
+        b, c = pair_at(np.arange(n_pairs), m)
+    else:
+        b, c = sample_pairs(m, n, seed)
+    return candidates[b], candidates[c]
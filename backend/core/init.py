@@ -1,75 +1,176 @@
+"""
+Every resource is loaded lazily, the first time an endpoint asks for it through
+require(), so a container only pays for what the functions it serves actually use
+(free_var_search never touches BERT or the model). Loading is once-only and
+thread-safe: concurrent inputs asking for the same resource wait for a single load.
+"""
 import sys
 import modal
 import os
 import numpy as np
 import time
-from sentence_transformers import SentenceTransformer
+import threading
+from core.store import load_BCV_store, load_BCV_lookup, LIST_FILE
+from core.ann import load_ann_index, BERT_ANN_FILE
+from core.suggest import load_suggest_index
+from core.descriptions import load_description_store
+from core.quantize import load_quantized_store
+from core.sampling import concept_type_rows
+from core.knn import load_knn_graph
+from core.metrics import metrics
 
 BCV_list = None
-BCV_values = None
+BCV_list_order = None
+BCV_types = None
+BCV_normed = None
+BCV_norms = None
+BCV_ann_index = None
+BCV_quantized = None
+BCV_knn_graph = None
 BCV_descriptions = None
+BCV_suggest_index = None
 BERT_sentences = None
 BERT_embeddings = None
+BERT_ann_index = None
 model = None
 
 DATA_PATH = "/root/embeddings" if not modal.is_local() else "embeddings"
 
+# seconds each resource took to load, in load order
+init_timings = {}
 
-def is_BCV_initialized():
-    return (
-        BCV_list is not None and BCV_values is not None and BCV_descriptions is not None
+
+def _load_BCV_list():
+    global BCV_list, BCV_list_order
+    BCV_list = np.load(os.path.join(DATA_PATH, LIST_FILE), mmap_mode="r")
+    BCV_list_order = load_BCV_lookup(DATA_PATH)
+
+
+def _load_BCV_types():
+    global BCV_types
+    require("BCV_list")
+    BCV_types = concept_type_rows(BCV_list)
+
+
+def _load_BCV_store():
+    global BCV_normed, BCV_norms
+    # the matrices are memory-mapped, so this only maps pages instead of reading them
+    BCV_normed, BCV_norms = load_BCV_store(DATA_PATH)
+
+
+def _load_BCV_ann_index():
+    global BCV_ann_index
+    # an index built for a store of another shape is ignored, searches then scan
+    require("BCV_store")
+    BCV_ann_index = load_ann_index(DATA_PATH, shape=BCV_normed.shape)
+
+
+def _load_BCV_quantized():
+    global BCV_quantized
+    # None unless build_quantized_store.py was run for this store, scans then use the
+    # float32 store
+    require("BCV_store")
+    BCV_quantized = load_quantized_store(DATA_PATH, BCV_normed.shape)
+
+
+def _load_BCV_knn_graph():
+    global BCV_knn_graph
+    require("BCV_list")
+    BCV_knn_graph = load_knn_graph(DATA_PATH, len(BCV_list))
+
+
+def _load_BCV_descriptions():
+    global BCV_descriptions
+    BCV_descriptions = load_description_store(DATA_PATH)
+
+
+def _load_BCV_suggest_index():
+    global BCV_suggest_index
+    BCV_suggest_index = load_suggest_index(DATA_PATH)
+
+
+def _load_BERT_embeddings():
+    global BERT_embeddings, BERT_ann_index
+    # L2-normalized by clean_data.py, only scanned directly when there is no index
+    BERT_embeddings = np.load(
+        os.path.join(DATA_PATH, "BERT_embeddings.npy"), mmap_mode="r"
     )
+    BERT_ann_index = load_ann_index(DATA_PATH, BERT_ANN_FILE, BERT_embeddings.shape)
+
 
+def _load_BERT_sentences():
+    global BERT_sentences
+    BERT_sentences = np.load(os.path.join(DATA_PATH, "BERT_sentences.npy"))
 
-def is_BERT_initialized():
-    return BERT_sentences is not None and BERT_embeddings is not None
 
+def _load_model():
+    global model
+    # imported here so that containers which never encode don't import torch either
+    from sentence_transformers import SentenceTransformer
 
-def is_model_initialized():
-    return model is not None
+    model = SentenceTransformer("bert-base-nli-mean-tokens")
 
 
-def is_everything_initialized():
-    return is_BCV_initialized() and is_BERT_initialized() and is_model_initialized()
+LOADERS = {
+    "BCV_list": _load_BCV_list,
+    "BCV_types": _load_BCV_types,
+    "BCV_store": _load_BCV_store,
+    "BCV_ann_index": _load_BCV_ann_index,
+    "BCV_quantized": _load_BCV_quantized,
+    "BCV_knn_graph": _load_BCV_knn_graph,
+    "BCV_descriptions": _load_BCV_descriptions,
+    "BCV_suggest_index": _load_BCV_suggest_index,
+    "BERT_embeddings": _load_BERT_embeddings,
+    "BERT_sentences": _load_BERT_sentences,
+    "model": _load_model,
+}
+_locks = {name: threading.Lock() for name in LOADERS}
+
+
+def require(*resources: str):
+    """Loads each of the given resources unless it already has been."""
+    for name in resources:
+        if name in init_timings:
+            continue
+        with _locks[name]:
+            # another thread may have loaded it while we were waiting for the lock
+            if name in init_timings:
+                continue
+            start = time.perf_counter()
+            # recorded under the endpoint whose request triggered the load
+            with metrics.span(f"load:{name}"):
+                LOADERS[name]()
+            init_timings[name] = time.perf_counter() - start
+            print(f"- Loaded {name} in {init_timings[name]:.3f} seconds")
+
+
+def is_initialized(*resources: str):
+    return all(name in init_timings for name in resources)
 
 
 def init_BCVs():
-    global BCV_list, BCV_values, BCV_descriptions, rev_BCV_descriptions
-    print("- Loading BCVs...", end="")
-    start = time.time()
-    BCV_list, BCV_values, BCV_descriptions = (
-        np.load(os.path.join(DATA_PATH, "BCV_list.npy")),
-        np.load(os.path.join(DATA_PATH, "BCV_values.npy")),
-        np.load(
-            os.path.join(DATA_PATH, "BCV_descriptions.npy"), allow_pickle=True
-        ).item(),
+    require(
+        "BCV_list",
+        "BCV_types",
+        "BCV_store",
+        "BCV_ann_index",
+        "BCV_quantized",
+        "BCV_knn_graph",
+        "BCV_descriptions",
+        "BCV_suggest_index",
     )
-    print(f"Done in {time.time() - start} seconds!")
 
 
 def init_BERTs():
-    global BERT_sentences, BERT_embeddings
-    print("- Loading BERT embeddings...", end="")
-    start = time.time()
-    BERT_embeddings = np.load(os.path.join(DATA_PATH, "BERT_embeddings.npy"))
-    print(f"Done in {time.time() - start} seconds!")
-
-    print("- Loading BERT sentences...", end="")
-    start = time.time()
-    BERT_sentences = np.load(os.path.join(DATA_PATH, "BERT_sentences.npy"))
-    print(f"Done in {time.time() - start} seconds!")
+    require("BERT_embeddings", "BERT_sentences")
 
 
 def init_model():
-    global model
-    print("- Loading model...", end="")
-    start = time.time()
-    model = SentenceTransformer("bert-base-nli-mean-tokens")
-    print(f"Done in {time.time() - start} seconds!")
+    require("model")
 
 
 def init_all_if_needed():
-    if not is_everything_initialized():
+    if not is_initialized(*LOADERS):
         print("----- Cold Start -----")
         start = time.time()
         init_BCVs()
@@ -80,10 +181,12 @@ def init_all_if_needed():
         print(
             f"""
             BCV_list:        \t{type(BCV_list)}  \t {BCV_list.shape} \t{sys.getsizeof(BCV_list)/1024/1024} MB
-            BCV_values:      \t{type(BCV_values)} \t {BCV_values.shape}\t {sys.getsizeof(BCV_values)/1024/1024} MB
-            BCV_descriptions:\t{type(BCV_descriptions)} \t\t\t {len(BCV_descriptions)} \t{sys.getsizeof(BCV_descriptions)/1024/1024} MB
+            BCV_normed:      \t{type(BCV_normed)} \t {BCV_normed.shape}\t {BCV_normed.nbytes/1024/1024} MB (mmap)
+            BCV_norms:       \t{type(BCV_norms)} \t {BCV_norms.shape}\t {BCV_norms.nbytes/1024/1024} MB (mmap)
+            BCV_descriptions:\t{type(BCV_descriptions[0])} \t {BCV_descriptions[1].shape} \t{BCV_descriptions[0].nbytes/1024/1024} MB (mmap)
             BERT_sentences:  \t{type(BERT_sentences)} \t {BERT_sentences.shape} \t{sys.getsizeof(BERT_sentences)/1024/1024} MB
             BERT_embeddings: \t{type(BERT_embeddings)} \t {BERT_embeddings.shape} \t{sys.getsizeof(BERT_embeddings)/1024/1024} MB
             """
         )
         print("----- End Cold Start -----")
+    print(f"- Load times: {init_timings}")
@@ -0,0 +1,116 @@
+"""
+Precomputed k-NN graph over the normalized BCV store.
+
+build_knn_graph.py computes every concept's top KNN_K neighbours (itself excluded)
+offline, with blocked matmuls spread over a small thread pool, and stores them as an
+(N, KNN_K) int32 index array and a matching float16 score array sorted descending.
+A similar-concepts lookup is then a slice of one row instead of a scan of the store.
+"""
+import os
+import contextlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from core.search import top_k_cosine
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+KNN_INDICES_FILE = "BCV_knn_indices.npy"
+KNN_SCORES_FILE = "BCV_knn_scores.npy"
+
+KNN_K = 64
+# query rows per task; each task scans the whole store once for its block
+KNN_BLOCK_SIZE = 1_024
+# BLAS already parallelizes each matmul, so only a few tasks run at once
+KNN_WORKERS = min(4, os.cpu_count())
+# bytes of similarity scores all tasks hold at once; sets how much of the store each
+# matmul takes (a 1024-row block against 65536 concepts alone would be 268 MB)
+KNN_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+def knn_block(
+    normed: np.ndarray,
+    start: int,
+    stop: int,
+    k: int = KNN_K,
+    concept_block_size: int = None,
+):
+    """Top k neighbours of rows start:stop, excluding each row itself."""
+    rows = np.arange(start, stop)
+    top, top_sims = top_k_cosine(
+        normed[start:stop], normed, k + 1, concept_block_size or len(normed)
+    )
+    # drop each row's own column, or the last one if it wasn't in its top k + 1
+    is_self = top == rows[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    return top[keep].reshape(-1, k), top_sims[keep].reshape(-1, k)
+
+
+def build_knn_graph(
+    path: str,
+    normed: np.ndarray,
+    k: int = KNN_K,
+    block_size: int = KNN_BLOCK_SIZE,
+    workers: int = KNN_WORKERS,
+    memory_budget: int = KNN_MEMORY_BUDGET,
+):
+    """
+    Writes the graph for normed into path, one block of rows per task. numpy releases
+    the GIL inside the matmuls, so the tasks run in parallel on a thread pool. Each
+    task scans the store in chunks sized so all workers' scores fit memory_budget, and
+    if threadpoolctl is installed the BLAS threads are split between the workers
+    instead of every worker's matmul using all cores.
+    """
+    open_memmap = np.lib.format.open_memmap
+    n = len(normed)
+    indices = open_memmap(
+        os.path.join(path, KNN_INDICES_FILE), mode="w+", dtype=np.int32, shape=(n, k)
+    )
+    scores = open_memmap(
+        os.path.join(path, KNN_SCORES_FILE), mode="w+", dtype=np.float16, shape=(n, k)
+    )
+
+    concept_block_size = max(k + 1, memory_budget // (4 * workers * block_size))
+
+    def run(start):
+        stop = min(start + block_size, n)
+        indices[start:stop], scores[start:stop] = knn_block(
+            normed, start, stop, k, concept_block_size
+        )
+
+    blas_limit = (
+        threadpool_limits(max(1, os.cpu_count() // workers), user_api="blas")
+        if threadpool_limits is not None
+        else contextlib.nullcontext()
+    )
+    with blas_limit, ThreadPoolExecutor(workers) as pool:
+        # list() so an exception in any task is raised here
+        list(pool.map(run, range(0, n, block_size)))
+    indices.flush()
+    scores.flush()
+    return indices, scores
+
+
+def load_knn_graph(path: str, n: int = None):
+    """
+    Returns the memory-mapped (indices, scores), or None if it hasn't been built or,
+    when the store's number of rows n is given, was built for a store of another size.
+    """
+    indices_path = os.path.join(path, KNN_INDICES_FILE)
+    if not os.path.exists(indices_path):
+        return None
+    indices = np.load(indices_path, mmap_mode="r")
+    if n is not None and len(indices) != n:
+        print(f"- Ignoring k-NN graph of {len(indices)} rows, store has {n}")
+        return None
+    scores = np.load(os.path.join(path, KNN_SCORES_FILE), mmap_mode="r")
+    return indices, scores
+
+
+def knn_neighbours(graph, row: int, k: int):
+    """(indices, scores) of the top k neighbours of row, sorted descending."""
+    indices, scores = graph
+    return np.asarray(indices[row, :k]), np.asarray(scores[row, :k], dtype=np.float32)
@@ -0,0 +1,59 @@
+"""
+manifest.json for the embeddings directory: shape, dtype, size and sha256 of every
+artifact, so a rebuilt directory can be checked before it is deployed.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def npy_header(path: str):
+    """(shape, dtype) of a .npy file, read from its header without loading it."""
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return list(shape), dtype.str
+
+
+def describe_file(path: str):
+    entry = {"bytes": os.path.getsize(path), "sha256": sha256_file(path)}
+    if path.endswith(".npy"):
+        entry["shape"], entry["dtype"] = npy_header(path)
+    return entry
+
+
+def write_manifest(path: str, filenames: list, removed: list = ()):
+    """
+    Adds/refreshes the given files in path's manifest and drops the removed ones,
+    keeping other entries.
+    """
+    manifest = read_manifest(path)
+    for filename in removed:
+        manifest.pop(filename, None)
+    for filename in filenames:
+        manifest[filename] = describe_file(os.path.join(path, filename))
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=2)
+    return manifest
+
+
+def read_manifest(path: str):
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
@@ -0,0 +1,287 @@
+"""
+In-process latency and count metrics for the backend.
+
+Code is timed with named spans (`with metrics.span("cosine"): ...`), each recorded
+into a histogram keyed by (endpoint, stage), where the endpoint is the one set by the
+enclosing `with metrics.endpoint(...)`, whose whole body is recorded as stage "total".
+Counters are keyed by (name, endpoint) the same way.
+
+Every Modal function runs in its own containers, so each container periodically
+flushes a JSON snapshot of its metrics to a shared directory, and the metrics
+endpoint merges all the snapshots it finds there into Prometheus text or JSON. A
+background thread flushes every FLUSH_INTERVAL while there is something new, and at
+least every HEARTBEAT_INTERVAL regardless, so a live container's snapshot is never
+older than that. Snapshots older than SNAPSHOT_TTL belong to containers that have
+shut down, and are deleted when the directory is read; their counts drop out of the
+merged totals, which Prometheus sees as a counter reset.
+"""
+import os
+import json
+import time
+import socket
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# upper bounds in seconds, Prometheus-style; the last bucket is +Inf
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+FLUSH_INTERVAL = 10.0
+HEARTBEAT_INTERVAL = 5 * 60.0
+SNAPSHOT_TTL = 3 * HEARTBEAT_INTERVAL
+
+# identifies this container among the ones sharing a volume
+INSTANCE = os.getenv("MODAL_TASK_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+_endpoint = contextvars.ContextVar("endpoint", default="none")
+
+
+def quantile(buckets: list, q: float):
+    """Estimates the q quantile from per-bucket counts, like histogram_quantile."""
+    total = sum(buckets)
+    if total == 0:
+        return None
+    rank, seen, lower = q * total, 0, 0.0
+    for upper, count in zip(BUCKETS + (float("inf"),), buckets):
+        if seen + count >= rank:
+            if upper == float("inf"):
+                return lower
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+        lower = upper
+    return lower
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # separate from lock, which snapshot() takes while a flush holds this one
+        self.flush_lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.flush_dir = None
+        self.flushed = 0.0
+        self.dirty = False
+        self.flusher = None
+        self.instance = INSTANCE
+
+    def observe(self, stage: str, seconds: float, endpoint: str = None):
+        key = (endpoint or _endpoint.get(), stage)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            i = next((i for i, b in enumerate(BUCKETS) if seconds <= b), len(BUCKETS))
+            histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            self.dirty = True
+
+    def inc(self, name: str, value: float = 1, endpoint: str = None):
+        key = (name, endpoint or _endpoint.get())
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    @contextmanager
+    def span(self, stage: str, endpoint: str = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, endpoint)
+
+    @contextmanager
+    def endpoint(self, name: str):
+        token = _endpoint.set(name)
+        try:
+            with self.span("total"):
+                yield
+        finally:
+            _endpoint.reset(token)
+            if self.flush_dir is not None:
+                self.start_flusher()
+
+    def iter_in_endpoint(self, iterator, name: str):
+        """
+        Runs every step of iterator inside endpoint name. For generators such as
+        streaming responses, which may be resumed in a different thread or context
+        each time and so can't hold an endpoint context open across their yields.
+        """
+        iterator = iter(iterator)
+        while True:
+            token = _endpoint.set(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _endpoint.reset(token)
+            yield item
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [
+                    {
+                        "endpoint": endpoint,
+                        "stage": stage,
+                        "buckets": list(h["buckets"]),
+                        "sum": h["sum"],
+                        "count": h["count"],
+                    }
+                    for (endpoint, stage), h in self.histograms.items()
+                ],
+                "counters": [
+                    {"name": name, "endpoint": endpoint, "value": value}
+                    for (name, endpoint), value in self.counters.items()
+                ],
+            }
+
+    def configure(self, flush_dir: str):
+        """
+        Enables flushing snapshots to flush_dir, shared by all containers, from a
+        background thread started on first use.
+        """
+        self.flush_dir = flush_dir
+
+    def start_flusher(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            if self.dirty or time.monotonic() - self.flushed > HEARTBEAT_INTERVAL:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes this instance's snapshot to flush_dir. Safe to call from any thread, and
+        a failed write is logged rather than raised, so it never fails a request or
+        stops the flusher thread.
+        """
+        if self.flush_dir is None:
+            return
+        # one flush at a time, since they all write through the same temporary file
+        with self.flush_lock:
+            self.flushed = time.monotonic()
+            self.dirty = False
+            path = os.path.join(self.flush_dir, f"{self.instance}.json")
+            try:
+                os.makedirs(self.flush_dir, exist_ok=True)
+                # write then rename, so readers never see a partial snapshot
+                with open(path + ".tmp", "w") as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                print(f"- Metrics flush failed: {e!r}")
+
+
+def read_snapshots(flush_dir: str, ttl: float = SNAPSHOT_TTL):
+    """Reads the live snapshots in flush_dir, deleting the ones older than ttl."""
+    snapshots = []
+    if not os.path.isdir(flush_dir):
+        return snapshots
+    for filename in os.listdir(flush_dir):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(flush_dir, filename)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except FileNotFoundError:
+            # deleted by another reader in the meantime
+            pass
+    return snapshots
+
+
+def merge_snapshots(snapshots: list):
+    """Sums the histograms and counters of several snapshots by key."""
+    histograms, counters = {}, {}
+    for snapshot in snapshots:
+        for h in snapshot["histograms"]:
+            key = (h["endpoint"], h["stage"])
+            merged = histograms.setdefault(
+                key,
+                {
+                    "endpoint": key[0],
+                    "stage": key[1],
+                    "buckets": [0] * len(h["buckets"]),
+                    "sum": 0.0,
+                    "count": 0,
+                },
+            )
+            merged["buckets"] = [a + b for a, b in zip(merged["buckets"], h["buckets"])]
+            merged["sum"] += h["sum"]
+            merged["count"] += h["count"]
+        for c in snapshot["counters"]:
+            key = (c["name"], c["endpoint"])
+            counters[key] = counters.get(key, 0) + c["value"]
+    return {
+        "histograms": list(histograms.values()),
+        "counters": [
+            {"name": name, "endpoint": endpoint, "value": value}
+            for (name, endpoint), value in counters.items()
+        ],
+    }
+
+
+def summarize(snapshot: dict):
+    """JSON-friendly view of a snapshot: count, mean, p50 and p99 per endpoint/stage."""
+    return {
+        "latency": [
+            {
+                "endpoint": h["endpoint"],
+                "stage": h["stage"],
+                "count": h["count"],
+                "mean_s": h["sum"] / h["count"] if h["count"] else None,
+                "p50_s": quantile(h["buckets"], 0.5),
+                "p99_s": quantile(h["buckets"], 0.99),
+            }
+            for h in snapshot["histograms"]
+        ],
+        "counters": snapshot["counters"],
+    }
+
+
+def to_prometheus(snapshot: dict, prefix: str = "bioconceptvec"):
+    lines = [
+        f"# HELP {prefix}_stage_seconds Latency of each endpoint stage.",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for h in snapshot["histograms"]:
+        labels = f'endpoint="{h["endpoint"]}",stage="{h["stage"]}"'
+        cumulative = 0
+        for upper, count in zip(BUCKETS + ("+Inf",), h["buckets"]):
+            cumulative += count
+            lines.append(
+                f'{prefix}_stage_seconds_bucket{{{labels},le="{upper}"}} {cumulative}'
+            )
+        lines.append(f"{prefix}_stage_seconds_sum{{{labels}}} {h['sum']}")
+        lines.append(f"{prefix}_stage_seconds_count{{{labels}}} {h['count']}")
+
+    names = sorted({c["name"] for c in snapshot["counters"]})
+    for name in names:
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        for c in snapshot["counters"]:
+            if c["name"] == name:
+                lines.append(
+                    f'{prefix}_{name}_total{{endpoint="{c["endpoint"]}"}} {c["value"]}'
+                )
+    return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
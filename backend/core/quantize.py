@@ -0,0 +1,135 @@
+"""
+Quantized copy of the normalized BCV store for the first-pass similarity scan.
+
+Rows are stored either as float16 or as int8 with one float32 scale per row
+(row ≈ values * scale), so a scan reads 1/2 or 1/4 of the bytes of BCV_normed.
+search.top_k_quantized re-ranks the scan's candidates against the float32 rows, so
+results only differ from the exact path when a true top k row falls outside the
+candidates, which quantization_report measures.
+"""
+import os
+import time
+import numpy as np
+from core.store import WRITE_BLOCK_SIZE, grow_npy
+from core.search import top_k_cosine, top_k_quantized, RERANK_FACTOR
+
+QUANTIZED_FILE = "BCV_quantized.npy"
+SCALES_FILE = "BCV_quantized_scales.npy"
+
+QUANTIZED_DTYPES = ("float16", "int8")
+
+
+def quantize_rows(normed: np.ndarray, dtype: str = "int8"):
+    """Returns (values, scales) for the given rows of the normalized store."""
+    normed = np.asarray(normed, dtype=np.float32)
+    if dtype == "float16":
+        return normed.astype(np.float16), np.ones(len(normed), dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(normed).max(axis=1) / 127
+        # zero rows get a scale of 1 so they stay zero instead of becoming NaN
+        scales = np.where(scales == 0, 1, scales).astype(np.float32)
+        return np.round(normed / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unsupported dtype {dtype}, expected one of {QUANTIZED_DTYPES}")
+
+
+def write_quantized_store(path: str, normed: np.ndarray, dtype: str = "int8"):
+    """Quantizes the normed store into path a block of rows at a time."""
+    open_memmap = np.lib.format.open_memmap
+    values = open_memmap(
+        os.path.join(path, QUANTIZED_FILE), mode="w+", dtype=dtype, shape=normed.shape
+    )
+    scales = open_memmap(
+        os.path.join(path, SCALES_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(normed),),
+    )
+    for start in range(0, len(normed), WRITE_BLOCK_SIZE):
+        stop = start + WRITE_BLOCK_SIZE
+        values[start:stop], scales[start:stop] = quantize_rows(
+            normed[start:stop], dtype
+        )
+    values.flush()
+    scales.flush()
+    return values, scales
+
+
+def update_quantized_rows(path: str, normed: np.ndarray, rows: np.ndarray):
+    """
+    Requantizes the given rows of an existing quantized store in place, keeping its
+    dtype, first growing it to normed's number of rows if rows were appended to the
+    store. Returns False if there is none or it can't be made to match normed's shape.
+    """
+    quantized = load_quantized_store(path)
+    if quantized is None:
+        return False
+    shape = quantized[0].shape
+    del quantized
+    if shape[1:] != normed.shape[1:] or shape[0] > len(normed):
+        return False
+    if shape[0] < len(normed):
+        filenames = (QUANTIZED_FILE, SCALES_FILE)
+        if not all(grow_npy(os.path.join(path, f), len(normed)) for f in filenames):
+            return False
+    values = np.load(os.path.join(path, QUANTIZED_FILE), mmap_mode="r+")
+    scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r+")
+    for start in range(0, len(rows), WRITE_BLOCK_SIZE):
+        block = rows[start : start + WRITE_BLOCK_SIZE]
+        values[block], scales[block] = quantize_rows(normed[block], values.dtype.name)
+    values.flush()
+    scales.flush()
+    return True
+
+
+def load_quantized_store(path: str, shape: tuple = None):
+    """
+    Returns the memory-mapped (values, scales), or None if it hasn't been built or,
+    when the store's shape is given, was built for a store of another shape.
+    """
+    values_path = os.path.join(path, QUANTIZED_FILE)
+    if not os.path.exists(values_path):
+        return None
+    values = np.load(values_path, mmap_mode="r")
+    if shape is not None and values.shape != tuple(shape):
+        print(f"- Ignoring quantized store of shape {values.shape}, store is {shape}")
+        return None
+    scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r")
+    return values, scales
+
+
+def quantization_report(
+    quantized,
+    normed: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    rerank_factor: int = RERANK_FACTOR,
+):
+    """Compares the quantized scan, with and without re-ranking, to the exact scan."""
+    start = time.time()
+    exact, _ = top_k_cosine(queries, normed, k)
+    exact_time = time.time() - start
+
+    # rerank_factor=1 keeps only k candidates, so this is the quantized scan alone
+    scan_only, _ = top_k_quantized(queries, quantized, normed, k, rerank_factor=1)
+
+    start = time.time()
+    reranked, _ = top_k_quantized(queries, quantized, normed, k, rerank_factor)
+    quantized_time = time.time() - start
+
+    def overlap(approx):
+        hits = [len(np.intersect1d(e, a)) for e, a in zip(exact, approx)]
+        return float(np.sum(hits) / (k * len(queries)))
+
+    values, scales = quantized
+    return {
+        "k": k,
+        "queries": len(queries),
+        "dtype": str(values.dtype),
+        "rerank_factor": rerank_factor,
+        f"scan_overlap@{k}": overlap(scan_only),
+        f"reranked_overlap@{k}": overlap(reranked),
+        "exact_ms_per_query": 1000 * exact_time / len(queries),
+        "quantized_ms_per_query": 1000 * quantized_time / len(queries),
+        "exact_mb": normed.nbytes / 1024 / 1024,
+        "quantized_mb": (values.nbytes + scales.nbytes) / 1024 / 1024,
+    }
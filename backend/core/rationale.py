@@ -0,0 +1,162 @@
+"""
+Concurrent GPT rationale generation.
+
+Rationales for many equations are requested in parallel on one event loop, with a
+semaphore bounding in-flight requests, a token bucket bounding the request rate,
+and per-row timeouts and retries with exponential backoff. Rows that still fail, or
+fail with a non-retryable error, get "N/A" rather than failing the whole batch.
+
+The limits default high enough that a typical explain_top batch goes out in a single
+wave (all rows in flight at once, within the bucket's burst), so the batch takes
+about as long as one call. They can be lowered with RATIONALE_MAX_CONCURRENCY and
+RATIONALE_REQUESTS_PER_SECOND to fit the account's rate limits.
+
+Rationales found in the optional RationaleCache are returned without a request, and
+new ones are written back to it.
+
+Point OPENAI_API_BASE at a local server (see mock_openai.py) to run it offline.
+"""
+import os
+import time
+import random
+import asyncio
+import openai
+from core.chatgpt import GPTVersion, build_message_list_explain_equation
+from core.cache import rationale_key
+from core.ratelimit import TokenBucket
+
+MAX_CONCURRENCY = int(os.getenv("RATIONALE_MAX_CONCURRENCY", 32))
+# sustained rate once the burst of MAX_CONCURRENCY requests is spent
+REQUESTS_PER_SECOND = float(os.getenv("RATIONALE_REQUESTS_PER_SECOND", 10.0))
+REQUEST_TIMEOUT = 90.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0
+
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.error.Timeout,
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+)
+
+
+async def agpt_rationale(
+    query: str,
+    gpt_version: GPTVersion,
+    semaphore: asyncio.Semaphore,
+    bucket: TokenBucket,
+    timeout: float = REQUEST_TIMEOUT,
+    max_retries: int = MAX_RETRIES,
+    cache=None,
+):
+    messages = build_message_list_explain_equation(query)
+    if cache is not None:
+        key = rationale_key(gpt_version.value, messages)
+        # sqlite calls block, so they run off the event loop
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
+
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                await bucket.acquire()
+                completion = await asyncio.wait_for(
+                    openai.ChatCompletion.acreate(
+                        model=gpt_version.value, messages=messages
+                    ),
+                    timeout,
+                )
+            rationale = completion.choices[0].message.content
+            if cache is not None:
+                await asyncio.to_thread(cache.put, key, rationale)
+            return rationale
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                print(f"- Giving up on rationale after {attempt + 1} attempts: {e!r}")
+                return "N/A"
+            # exponential backoff with jitter, outside the semaphore
+            await asyncio.sleep(BACKOFF_BASE * 2**attempt * (1 + random.random()))
+        except openai.error.OpenAIError as e:
+            # e.g. invalid request or authentication, which a retry won't fix
+            print(f"- Rationale failed: {e!r}")
+            return "N/A"
+
+
+async def agpt_rationales(
+    queries: list,
+    gpt_version: GPTVersion,
+    max_concurrency: int = MAX_CONCURRENCY,
+    requests_per_second: float = REQUESTS_PER_SECOND,
+    timeout: float = REQUEST_TIMEOUT,
+    cache=None,
+):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # the burst matches the concurrency, so a batch that fits goes out in one wave
+    bucket = TokenBucket(requests_per_second, capacity=max_concurrency)
+    rationales = await asyncio.gather(
+        *(
+            agpt_rationale(query, gpt_version, semaphore, bucket, timeout, cache=cache)
+            for query in queries
+        ),
+        return_exceptions=True,
+    )
+    # anything agpt_rationale didn't handle still only fails its own row
+    for rationale in rationales:
+        if isinstance(rationale, Exception):
+            print(f"- Rationale failed: {rationale!r}")
+    return [
+        "N/A" if isinstance(rationale, Exception) else rationale
+        for rationale in rationales
+    ]
+
+
+def gpt_rationale_stream(
+    query: str,
+    gpt_version: GPTVersion,
+    cache=None,
+    timeout: float = REQUEST_TIMEOUT,
+    max_retries: int = MAX_RETRIES,
+):
+    """
+    Yields the rationale in pieces as they are generated, with the same timeout and
+    retry policy as agpt_rationale. The timeout applies to every read, so a stalled
+    stream fails instead of hanging. A request is only retried until its first piece
+    has been yielded (a retry would repeat the text already sent); any later failure,
+    or running out of retries, is raised to the caller.
+    """
+    messages = build_message_list_explain_equation(query)
+    if cache is not None:
+        key = rationale_key(gpt_version.value, messages)
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    pieces = []
+    for attempt in range(max_retries + 1):
+        try:
+            for chunk in openai.ChatCompletion.create(
+                model=gpt_version.value,
+                messages=messages,
+                stream=True,
+                request_timeout=timeout,
+            ):
+                delta = chunk.choices[0].delta.get("content")
+                if delta:
+                    pieces.append(delta)
+                    yield delta
+            break
+        except RETRYABLE_ERRORS:
+            if pieces or attempt == max_retries:
+                raise
+            time.sleep(BACKOFF_BASE * 2**attempt * (1 + random.random()))
+    if cache is not None:
+        cache.put(key, "".join(pieces))
+
+
+def gpt_rationales(queries: list, gpt_version: GPTVersion, **kwargs):
+    """Blocking wrapper around agpt_rationales, for sync endpoints."""
+    return asyncio.run(agpt_rationales(queries, gpt_version, **kwargs))
@@ -0,0 +1,79 @@
+"""
+(B, C) pair samplers for the free variable search.
+
+Pairs are drawn without replacement from the n * (n - 1) ordered pairs with B != C,
+by sampling pair indices and decoding them with pair_at, so no sample is spent on a
+B == C or duplicate pair. Every sampler takes a seed, and the same seed always gives
+the same pairs, so seeded searches are reproducible and their results cacheable.
+"""
+import numpy as np
+
+# concept ids are "<type>_<id>", e.g. Gene_1017, Chemical_MESH_D001194, SNP_rs1801133
+TYPE_SEPARATOR = "_"
+
+
+def concept_type_rows(BCV_list: np.ndarray):
+    """Maps each concept type prefix to the sorted rows of BCV_list of that type."""
+    types = np.char.partition(np.asarray(BCV_list), TYPE_SEPARATOR)[:, 0]
+    names, inverse = np.unique(types, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(names) + 1))
+    return {
+        str(name): order[bounds[i] : bounds[i + 1]] for i, name in enumerate(names)
+    }
+
+
+def pair_at(pair_indices: np.ndarray, n_concepts: int):
+    """
+    Decodes indices in [0, n * (n - 1)) into (b, c) with b != c: b is the index divided
+    by n - 1, and the remainder picks c among the other n - 1 concepts.
+    """
+    b, r = np.divmod(np.asarray(pair_indices, dtype=np.int64), n_concepts - 1)
+    return b, r + (r >= b)
+
+
+def sample_pairs(n_concepts: int, n: int, seed=None):
+    """
+    Up to n distinct (b, c) pairs of rows in [0, n_concepts) with b != c, as
+    (b_indices, c_indices). Fewer are returned only if there are fewer such pairs.
+    """
+    rng = np.random.default_rng(seed)
+    n_pairs = n_concepts * (n_concepts - 1)
+    pair_indices = rng.choice(n_pairs, size=min(n, n_pairs), replace=False)
+    return pair_at(pair_indices, n_concepts)
+
+
+def sample_stratified_pairs(type_rows: dict, n: int, seed=None, types=None):
+    """
+    Like sample_pairs, but B and C are always of the same concept type, and n is
+    split as evenly as possible over the given types (all of them by default). A
+    type with fewer possible pairs than its share gets all of them, and the rest is
+    spread over the other types.
+    """
+    rng = np.random.default_rng(seed)
+    types = sorted(type_rows) if types is None else list(types)
+    unknown = [t for t in types if t not in type_rows]
+    if unknown:
+        raise ValueError(f"Unknown concept types {unknown}, expected {sorted(type_rows)}")
+
+    # fill the smallest strata first so their leftover share goes to the larger ones
+    capacity = {t: len(type_rows[t]) * (len(type_rows[t]) - 1) for t in types}
+    shares, remaining = {}, n
+    for i, t in enumerate(sorted(types, key=capacity.get)):
+        shares[t] = min(capacity[t], remaining // (len(types) - i))
+        remaining -= shares[t]
+
+    b_indices, c_indices = [], []
+    for t in types:
+        if shares[t] == 0:
+            continue
+        b, c = sample_pairs(len(type_rows[t]), shares[t], seed=rng)
+        b_indices.append(type_rows[t][b])
+        c_indices.append(type_rows[t][c])
+    if not b_indices:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    # interleave the strata so every equation block sees all of them
+    shuffle = rng.permutation(sum(len(b) for b in b_indices))
+    return np.concatenate(b_indices)[shuffle], np.concatenate(c_indices)[shuffle]
@@ -0,0 +1,188 @@
+"""
+Batched array helpers for the free variable search (Q + B - C = D).
+
+Everything here works on whole blocks of equations at once, so the only per-row
+Python work left in an endpoint is formatting the rows that survive the threshold.
+"""
+import numpy as np
+from core.store import BCV_rows, normalize_rows
+
+# worst case Q, B, C are all in the top 3, in which case D is the 4th
+D_CANDIDATES = 4
+
+# rows of each similarity block are equations, columns are concepts
+EQUATION_BLOCK_SIZE = 256
+CONCEPT_BLOCK_SIZE = 65_536
+
+# candidates kept per vector by the quantized scan for exact re-ranking, as a multiple
+# of k
+RERANK_FACTOR = 4
+
+
+def top_k(sims: np.ndarray, k: int):
+    """Returns (indices, sims) of the k largest entries per row, sorted descending."""
+    k = min(k, sims.shape[1])
+    if k <= 0:
+        # argpartition(...)[:, -0:] would keep every column
+        return empty_top_k(len(sims), sims.dtype)
+    top = np.argpartition(sims, -k, axis=1)[:, -k:]
+    top_sims = np.take_along_axis(sims, top, axis=1)
+
+    # argpartition doesn't sort the top k, so sort each row descending
+    order = np.argsort(-top_sims, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(
+        top_sims, order, axis=1
+    )
+
+
+def empty_top_k(rows: int, dtype=np.float32):
+    """The (indices, sims) of a top k search with k <= 0: rows empty rows."""
+    return np.empty((rows, 0), dtype=np.int64), np.empty((rows, 0), dtype=dtype)
+
+
+def top_k_cosine(
+    vectors: np.ndarray,
+    normed: np.ndarray,
+    k: int,
+    concept_block_size: int = CONCEPT_BLOCK_SIZE,
+):
+    """
+    Top k cosine matches of each vector against the normed store, scanning the store in
+    blocks of concept_block_size rows and keeping only a running top k per vector, so
+    memory is bounded by len(vectors) * concept_block_size instead of the full matrix.
+    """
+    vectors_normed, _ = normalize_rows(np.atleast_2d(vectors))
+    top, top_sims = empty_top_k(len(vectors_normed))
+    if k <= 0:
+        return top, top_sims
+    for start in range(0, len(normed), concept_block_size):
+        block_sims = vectors_normed @ normed[start : start + concept_block_size].T
+        block_top, block_top_sims = top_k(block_sims, k)
+        top, top_sims = merge_top_k(
+            (top, top_sims), (block_top + start, block_top_sims), k
+        )
+    return top, top_sims
+
+
+def top_k_quantized(
+    vectors: np.ndarray,
+    quantized,
+    normed: np.ndarray,
+    k: int,
+    rerank_factor: int = RERANK_FACTOR,
+    concept_block_size: int = CONCEPT_BLOCK_SIZE,
+):
+    """
+    Same contract as top_k_cosine, but the scan reads the (values, scales) quantized
+    copy of the store, which is 2-4x smaller than normed. Only the best
+    k * rerank_factor candidates per vector are then re-scored against the float32
+    rows of normed.
+    """
+    values, scales = quantized
+    vectors_normed, _ = normalize_rows(np.atleast_2d(vectors))
+    n_candidates = min(k * rerank_factor, len(values))
+    top, top_sims = empty_top_k(len(vectors_normed))
+    if k <= 0:
+        return top, top_sims
+    for start in range(0, len(values), concept_block_size):
+        stop = start + concept_block_size
+        block = np.asarray(values[start:stop], dtype=np.float32)
+        block_sims = (vectors_normed @ block.T) * scales[start:stop]
+        block_top, block_top_sims = top_k(block_sims, n_candidates)
+        top, top_sims = merge_top_k(
+            (top, top_sims), (block_top + start, block_top_sims), n_candidates
+        )
+
+    candidates = normed[top.ravel()].reshape(*top.shape, -1)
+    exact_sims = np.einsum("ijd,id->ij", candidates, vectors_normed)
+    reranked, reranked_sims = top_k(exact_sims, k)
+    return np.take_along_axis(top, reranked, axis=1), reranked_sims
+
+
+def merge_top_k(a, b, k: int):
+    """Merges two (indices, sims) top k results into one, sorted descending."""
+    indices = np.concatenate([a[0], b[0]], axis=1)
+    sims = np.concatenate([a[1], b[1]], axis=1)
+    top, top_sims = top_k(sims, k)
+    return np.take_along_axis(indices, top, axis=1), top_sims
+
+
+def select_D(top: np.ndarray, top_sims: np.ndarray, b_indices, c_indices, q_index: int):
+    """
+    Given each equation's sorted top D_CANDIDATES matches, picks the most similar
+    concept that isn't Q, B or C. Returns (d_indices, d_sims).
+    """
+    # mask out q, b, c and take the first remaining column of every row
+    excluded = (
+        (top == np.asarray(b_indices)[:, None])
+        | (top == np.asarray(c_indices)[:, None])
+        | (top == q_index)
+    )
+    first = np.argmax(~excluded, axis=1)
+    rows = np.arange(len(top))
+    return top[rows, first], top_sims[rows, first]
+
+
+def iter_free_var_search(
+    q_index: int,
+    normed: np.ndarray,
+    norms: np.ndarray,
+    pairs,
+    sim_threshold: float,
+    block_size: int = EQUATION_BLOCK_SIZE,
+    concept_block_size: int = CONCEPT_BLOCK_SIZE,
+    quantized=None,
+):
+    """
+    Runs the free variable search Q + B - C = D over the (b_indices, c_indices) pairs
+    from one of the core.sampling samplers, one block of block_size equations at a
+    time. Yields (d_sims, b_indices, c_indices, d_indices) for the rows of each block
+    above sim_threshold, sorted within the block. Peak memory depends on the block
+    sizes, not on the number of pairs. If a quantized copy of the store is given, the
+    D candidates are found with top_k_quantized instead of a float32 scan.
+    """
+    q_vector = BCV_rows(normed, norms, q_index)
+    all_b_indices, all_c_indices = pairs
+    for start in range(0, len(all_b_indices), block_size):
+        b_indices = all_b_indices[start : start + block_size]
+        c_indices = all_c_indices[start : start + block_size]
+
+        d_vectors = (
+            q_vector
+            + BCV_rows(normed, norms, b_indices)
+            - BCV_rows(normed, norms, c_indices)
+        )
+        if quantized is None:
+            top, top_sims = top_k_cosine(
+                d_vectors, normed, D_CANDIDATES, concept_block_size
+            )
+        else:
+            top, top_sims = top_k_quantized(
+                d_vectors,
+                quantized,
+                normed,
+                D_CANDIDATES,
+                concept_block_size=concept_block_size,
+            )
+        d_indices, d_sims = select_D(top, top_sims, b_indices, c_indices, q_index)
+        yield filter_by_similarity(sim_threshold, d_sims, b_indices, c_indices, d_indices)
+
+
+def concat_results(blocks):
+    """Concatenates the blocks yielded by iter_free_var_search into one sorted result."""
+    blocks = list(blocks)
+    if not blocks:
+        empty = np.empty(0, dtype=np.int64)
+        return np.empty(0, dtype=np.float32), empty, empty, empty
+    d_sims, *columns = (np.concatenate(column) for column in zip(*blocks))
+    return filter_by_similarity(-np.inf, d_sims, *columns)
+
+
+def filter_by_similarity(sim_threshold: float, d_sims: np.ndarray, *columns):
+    """
+    Drops rows below sim_threshold and sorts the rest by descending similarity.
+    Returns (d_sims, *columns) with the same filtering/ordering applied to each column.
+    """
+    keep = np.flatnonzero(d_sims >= sim_threshold)
+    keep = keep[np.argsort(-d_sims[keep], kind="stable")]
+    return (d_sims[keep], *(np.asarray(column)[keep] for column in columns))
@@ -0,0 +1,207 @@
+"""
+On-disk BCV matrix store.
+
+BCV rows are stored L2-normalized (float32) alongside a sidecar of their original
+norms, so cosine search is a single matmul against the memory-mapped matrix and the
+raw vectors can still be recovered as normed * norm. Both files are opened with
+mmap_mode so every worker on a host shares the same page cache.
+"""
+import os
+import numpy as np
+
+LIST_FILE = "BCV_list.npy"
+NORMED_FILE = "BCV_normed.npy"
+NORMS_FILE = "BCV_norms.npy"
+LIST_ORDER_FILE = "BCV_list_order.npy"
+
+# rows normalized and written per block when streaming a store to disk
+WRITE_BLOCK_SIZE = 4_096
+
+
+def normalize_rows(values: np.ndarray):
+    values = np.asarray(values, dtype=np.float32)
+    norms = np.linalg.norm(values, axis=1).astype(np.float32)
+    # zero vectors stay zero instead of becoming NaN
+    safe_norms = np.where(norms == 0, 1, norms)
+    return values / safe_norms[:, None], norms
+
+
+def write_BCV_store(path: str, items, n: int, dim: int, key_len: int):
+    """
+    Streams (concept, vector) pairs into preallocated BCV_list/normed/norms files, a
+    block at a time, so memory use doesn't grow with the number of concepts.
+    """
+    open_memmap = np.lib.format.open_memmap
+    BCV_list = open_memmap(
+        os.path.join(path, LIST_FILE), mode="w+", dtype=f"<U{key_len}", shape=(n,)
+    )
+    normed = open_memmap(
+        os.path.join(path, NORMED_FILE), mode="w+", dtype=np.float32, shape=(n, dim)
+    )
+    norms = open_memmap(
+        os.path.join(path, NORMS_FILE), mode="w+", dtype=np.float32, shape=(n,)
+    )
+
+    block = np.empty((WRITE_BLOCK_SIZE, dim), dtype=np.float32)
+    start = 0
+    for i, (key, vector) in enumerate(items):
+        BCV_list[i] = key
+        block[i - start] = vector
+        if i + 1 - start == WRITE_BLOCK_SIZE:
+            normed[start : i + 1], norms[start : i + 1] = normalize_rows(block)
+            start = i + 1
+    if start < n:
+        normed[start:], norms[start:] = normalize_rows(block[: n - start])
+
+    for array in (BCV_list, normed, norms):
+        array.flush()
+    return BCV_list, normed, norms
+
+
+def grow_npy(path: str, n: int):
+    """
+    Grows the first axis of the C-ordered .npy at path to n in place, with zeroed new
+    rows, by rewriting the shape in its header and extending the file. Returns False
+    if the new header doesn't fit in the old one's padding (or the array is
+    Fortran-ordered), in which case the file is left untouched.
+    """
+    format = np.lib.format
+    with open(path, "r+b") as f:
+        version = format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = format.read_array_header_2_0(f)
+        data_offset = f.tell()
+        if fortran_order or n < shape[0]:
+            return False
+        header = repr(
+            {
+                "descr": format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": (n, *shape[1:]),
+            }
+        )
+        # magic string, version and header length field
+        prefix_len = 10 if version == (1, 0) else 12
+        padding = data_offset - prefix_len - len(header) - 1
+        if padding < 0:
+            return False
+        f.seek(prefix_len)
+        f.write((header + " " * padding + "\n").encode("latin1"))
+        f.truncate(data_offset + n * int(np.prod(shape[1:])) * dtype.itemsize)
+    return True
+
+
+def update_BCV_store(path: str, items, n: int, dim: int, key_len: int):
+    """
+    Incremental write_BCV_store: streams (concept, vector) pairs against the existing
+    store in path and rewrites, in place, only the rows whose concept or vector changed.
+    If concepts were only appended, the files are grown and only the new rows written.
+    Returns (BCV_list, normed, norms, changed_rows, renamed_rows), or None if the store
+    doesn't exist or lost rows or changed dimension, and has to be rebuilt with
+    write_BCV_store.
+    """
+    if not os.path.exists(os.path.join(path, LIST_FILE)):
+        return None
+    old_list = np.load(os.path.join(path, LIST_FILE), mmap_mode="r")
+    old_shape = np.load(os.path.join(path, NORMED_FILE), mmap_mode="r").shape
+    if (
+        old_shape[1] != dim
+        or n < old_shape[0]
+        or key_len > old_list.dtype.itemsize // 4
+    ):
+        return None
+    del old_list
+    if n > old_shape[0]:
+        filenames = (LIST_FILE, NORMED_FILE, NORMS_FILE)
+        if not all(grow_npy(os.path.join(path, filename), n) for filename in filenames):
+            return None
+    BCV_list = np.load(os.path.join(path, LIST_FILE), mmap_mode="r+")
+    normed = np.load(os.path.join(path, NORMED_FILE), mmap_mode="r+")
+    norms = np.load(os.path.join(path, NORMS_FILE), mmap_mode="r+")
+
+    changed, renamed = [], []
+
+    def update_block(start, keys, block):
+        block_normed, block_norms = normalize_rows(block)
+        stop = start + len(keys)
+        keys_differ = np.asarray(keys) != BCV_list[start:stop]
+        rows_differ = (
+            keys_differ
+            | (block_norms != norms[start:stop])
+            | np.any(block_normed != normed[start:stop], axis=1)
+        )
+        rows = np.flatnonzero(rows_differ)
+        BCV_list[start + rows] = np.asarray(keys)[rows]
+        normed[start + rows] = block_normed[rows]
+        norms[start + rows] = block_norms[rows]
+        changed.append(start + rows)
+        renamed.append(start + np.flatnonzero(keys_differ))
+
+    block = np.empty((WRITE_BLOCK_SIZE, dim), dtype=np.float32)
+    keys, start = [], 0
+    for i, (key, vector) in enumerate(items):
+        keys.append(key)
+        block[i - start] = vector
+        if len(keys) == WRITE_BLOCK_SIZE:
+            update_block(start, keys, block)
+            keys, start = [], i + 1
+    if keys:
+        update_block(start, keys, block[: len(keys)])
+
+    for array in (BCV_list, normed, norms):
+        array.flush()
+    return BCV_list, normed, norms, np.concatenate(changed), np.concatenate(renamed)
+
+
+def write_normalized(values: np.ndarray, out_path: str):
+    """Writes an L2-normalized float32 copy of values, one block of rows at a time."""
+    out = np.lib.format.open_memmap(
+        out_path, mode="w+", dtype=np.float32, shape=values.shape
+    )
+    for start in range(0, len(values), WRITE_BLOCK_SIZE):
+        out[start : start + WRITE_BLOCK_SIZE], _ = normalize_rows(
+            values[start : start + WRITE_BLOCK_SIZE]
+        )
+    out.flush()
+    return out
+
+
+def load_BCV_store(path: str):
+    normed = np.load(os.path.join(path, NORMED_FILE), mmap_mode="r")
+    norms = np.load(os.path.join(path, NORMS_FILE), mmap_mode="r")
+    return normed, norms
+
+
+def BCV_rows(normed: np.ndarray, norms: np.ndarray, indices):
+    """Recovers the raw (un-normalized) BCV vectors for the given row indices."""
+    return normed[indices] * norms[indices][..., None]
+
+
+def cosine_scores(vectors: np.ndarray, normed: np.ndarray):
+    """Cosine similarity of each row of vectors against every row of the normed store."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    vectors_normed, _ = normalize_rows(vectors)
+    return vectors_normed @ normed.T
+
+
+def save_BCV_lookup(path: str, BCV_list: np.ndarray):
+    """Writes the permutation that sorts BCV_list, used by BCV_index_of."""
+    np.save(os.path.join(path, LIST_ORDER_FILE), np.argsort(BCV_list).astype(np.int64))
+
+
+def load_BCV_lookup(path: str):
+    return np.load(os.path.join(path, LIST_ORDER_FILE), mmap_mode="r")
+
+
+def BCV_index_of(BCV_list: np.ndarray, order: np.ndarray, concept: str):
+    """Row of concept in BCV_list by binary search over its sort order, or None."""
+    # an id wider than the list's <U dtype can't be in it, and searchsorted would
+    # cast-copy the whole mapped list to the wider dtype to compare against it
+    if len(concept) > BCV_list.dtype.itemsize // 4:
+        return None
+    pos = int(np.searchsorted(BCV_list, concept, sorter=order))
+    if pos < len(order) and BCV_list[order[pos]] == concept:
+        return int(order[pos])
+    return None
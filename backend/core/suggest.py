@@ -0,0 +1,97 @@
+"""
+Sorted prefix index for concept autosuggest.
+
+Every word start of every (lowercased) concept description becomes a key, so "canc"
+matches both "cancer of the lung" and "lung cancer". Keys are truncated UTF-8 bytes
+held in sorted arrays: one of the description starts only, and one of all word starts.
+A lookup is a bounded range lookup in each (the description starts first, so they
+always rank first), independent of the vocabulary size.
+"""
+import os
+import re
+import numpy as np
+
+KEYS_FILE = "suggest_keys.npy"
+ROWS_FILE = "suggest_rows.npy"
+FIRST_KEYS_FILE = "suggest_first_keys.npy"
+FIRST_ROWS_FILE = "suggest_first_rows.npy"
+
+MAX_KEY_BYTES = 32
+# how many matching keys a lookup looks at in each index; bounds the cost of very
+# short queries such as "a" that match a large part of the vocabulary
+MAX_SCAN = 2_048
+
+SUGGEST_FILES = (KEYS_FILE, ROWS_FILE, FIRST_KEYS_FILE, FIRST_ROWS_FILE)
+
+WORD_START = re.compile(r"(?:^|(?<=[\s\-(/,]))\w")
+
+
+def description_variants(description):
+    if description is None:
+        return []
+    if isinstance(description, str):
+        return [description]
+    return [d for d in description if d]
+
+
+def sorted_keys(keys: list, rows: list):
+    keys = np.array(keys, dtype=f"S{MAX_KEY_BYTES}")
+    order = np.argsort(keys, kind="stable")
+    return keys[order], np.array(rows, dtype=np.int32)[order]
+
+
+def build_suggest_index(BCV_list: np.ndarray, BCV_descriptions: dict):
+    """(keys, rows, first_keys, first_rows): all word starts, then description starts."""
+    keys, rows, first_keys, first_rows = [], [], [], []
+    for row, concept in enumerate(BCV_list):
+        for description in description_variants(BCV_descriptions.get(concept)):
+            text = description.lower()
+            for match in WORD_START.finditer(text):
+                key = text[match.start() :].encode()[:MAX_KEY_BYTES]
+                keys.append(key)
+                rows.append(row)
+                if match.start() == 0:
+                    first_keys.append(key)
+                    first_rows.append(row)
+    return (*sorted_keys(keys, rows), *sorted_keys(first_keys, first_rows))
+
+
+def save_suggest_index(path: str, index):
+    for filename, array in zip(SUGGEST_FILES, index):
+        np.save(os.path.join(path, filename), array)
+
+
+def load_suggest_index(path: str):
+    return tuple(
+        np.load(os.path.join(path, filename), mmap_mode="r")
+        for filename in SUGGEST_FILES
+    )
+
+
+def prefix_rows(keys: np.ndarray, rows: np.ndarray, prefix: bytes):
+    """Rows of the first MAX_SCAN keys starting with prefix, in key order."""
+    lo = np.searchsorted(keys, prefix, side="left")
+    hi = np.searchsorted(keys, prefix + b"\xff", side="left")
+    return np.asarray(rows[lo : min(hi, lo + MAX_SCAN)])
+
+
+def suggest_rows(index, query: str, limit: int):
+    """
+    Rows whose description has a word starting with query, best first: matches at the
+    start of a description rank above matches inside it, then shorter/alphabetically
+    earlier keys first. Each row is returned once. Only the first MAX_KEY_BYTES of the
+    query are matched.
+    """
+    keys, rows, first_keys, first_rows = index
+    prefix = query.strip().lower().encode()[:MAX_KEY_BYTES]
+    if not prefix:
+        return []
+
+    ranked = prefix_rows(first_keys, first_rows, prefix)
+    # only look inside descriptions if the description starts didn't fill the limit
+    if len(np.unique(ranked)) < limit:
+        ranked = np.concatenate([ranked, prefix_rows(keys, rows, prefix)])
+
+    # keep the best-ranked occurrence of each row
+    _, first = np.unique(ranked, return_index=True)
+    return ranked[np.sort(first)][:limit].tolist()
@@ -1,20 +1,28 @@
+import os
+import json
 import time
-import pandas as pd
+import threading
+from typing import List, Optional
 import numpy as np
-from tqdm import tqdm
 import modal
-from sklearn.metrics.pairwise import cosine_similarity
-from core.init import init_all_if_needed
-from core.chatgpt import load_openai_key, gpt_rationale, GPTVersion
-
-init_all_if_needed()  # init all the data then load it
-from core.init import (
-    model,
-    BERT_embeddings,
-    BERT_sentences,
-    BCV_list,
-    BCV_values,
-    BCV_descriptions,
+from fastapi import Query
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from core import init as resources
+from core.chatgpt import load_openai_key, GPTVersion
+from core.rationale import gpt_rationales, gpt_rationale_stream
+from core.cache import open_shared_cache
+from core.batching import EncodeBatcher
+from core.store import cosine_scores
+from core.search import EQUATION_BLOCK_SIZE, concat_results
+from core.expression import expression_coefficients
+from core.guided import NEIGHBOURHOOD_SIZE
+from core import endpoints
+from core.metrics import (
+    metrics,
+    read_snapshots,
+    merge_snapshots,
+    summarize,
+    to_prometheus,
 )
 
 DATA_PATH = "/root/embeddings"
@@ -28,34 +36,142 @@ mounts = [
 
 stub = modal.Stub(name="BioConceptVecXplorer", mounts=mounts, image=image)
 
+# rationales are cached on a persisted volume so they survive container restarts, and
+# every container flushes its metrics snapshot there for the metrics endpoint to merge
+CACHE_DIR = "/root/cache"
+# one SQLite database per container, see core.cache.open_shared_cache
+RATIONALE_CACHE_DIR = (
+    os.path.join(CACHE_DIR, "rationales") if not modal.is_local() else "rationale_cache"
+)
+METRICS_DIR = os.path.join(CACHE_DIR, "metrics") if not modal.is_local() else "metrics"
+cache_volume = modal.SharedVolume().persist("bioconceptxplorer-rationales")
+rationale_cache = None
+metrics.configure(METRICS_DIR)
+
+
+def get_rationale_cache():
+    global rationale_cache
+    if rationale_cache is None:
+        rationale_cache = open_shared_cache(RATIONALE_CACHE_DIR)
+    return rationale_cache
+
+
+encoder = None
+encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    global encoder
+    with encoder_lock:
+        if encoder is None:
+            resources.require("model")
+            encoder = EncodeBatcher(resources.model.encode)
+    return encoder
 
-@stub.function(cpu=2, memory=2048, container_idle_timeout=300, keep_warm=1)
+
+# concurrent inputs share a container, so the encoder can batch them together
+@stub.function(
+    cpu=2,
+    memory=2048,
+    container_idle_timeout=300,
+    keep_warm=1,
+    allow_concurrent_inputs=16,
+    shared_volumes={CACHE_DIR: cache_volume},
+)
 @modal.web_endpoint(method="GET")
 def bert_query(query: str, top_k: int = 10):
-    query_vector = model.encode([query])
-    sims = cosine_similarity(query_vector, BERT_embeddings)[0]
-    indices = np.argsort(sims)[::-1][:top_k]
-    options = [(BERT_sentences[i].strip("\n"), float(sims[i])) for i in indices]
-    return options
+    with metrics.endpoint("bert_query"):
+        resources.require("BERT_embeddings", "BERT_sentences")
+        with metrics.span("encode"):
+            query_vector = get_encoder().encode(query)[None, :]
+        return endpoints.bert_matches(resources, query_vector, top_k)
+
+
+@stub.function(shared_volumes={CACHE_DIR: cache_volume})
+@modal.web_endpoint(method="GET")
+def autosuggest(query: str, limit: int = 10) -> list:
+    with metrics.endpoint("autosuggest"):
+        resources.require("BCV_list", "BCV_descriptions", "BCV_suggest_index")
+        return endpoints.suggest_concepts(resources, query, limit)
+
+
+@stub.function(shared_volumes={CACHE_DIR: cache_volume})
+@modal.web_endpoint(method="GET")
+def compute_expression(
+    # repeated query parameters, e.g. ?expression=A&expression=%2B&expression=B
+    expression: List[str] = Query(...),
+    top_k: int = 10,
+    exact: bool = False,
+) -> dict:
+    with metrics.endpoint("compute_expression"):
+        resources.require("BCV_list", "BCV_store", "BCV_ann_index", "BCV_quantized")
+        try:
+            result = endpoints.expression_vector(resources, expression)
+        except ValueError as e:
+            return {"error": str(e)}
+        return endpoints.top_BCV_matches(resources, result, top_k, exact=exact)[0]
+
+
+"""
+Batched compute_expression: takes a list of expressions in the request body and returns
+the top k matches for each of them, in order, from one round trip.
+"""
+
+
+@stub.function(
+    cpu=2,
+    memory=2048,
+    container_idle_timeout=300,
+    shared_volumes={CACHE_DIR: cache_volume},
+)
+@modal.web_endpoint(method="POST")
+def compute_expressions(
+    expressions: list, top_k: int = 10, exact: bool = False
+) -> list:
+    with metrics.endpoint("compute_expressions"):
+        resources.require("BCV_list", "BCV_store", "BCV_ann_index", "BCV_quantized")
+        if not expressions:
+            return []
+        try:
+            coefficients = expression_coefficients(
+                expressions, get_BCV_index, resources.BCV_norms
+            )
+        except ValueError as e:
+            return {"error": str(e)}
+        with metrics.span("vectors"):
+            results = coefficients @ resources.BCV_normed
+        return endpoints.top_BCV_matches(resources, results, top_k, exact=exact)
 
 
-@stub.function()
+@stub.function(shared_volumes={CACHE_DIR: cache_volume})
 @modal.web_endpoint(method="GET")
-def compute_expression(expression: list, top_k: int = 10) -> dict:
-    pass
+def get_similar_concepts(concept_query: str, k: int = 10, exact: bool = False) -> dict:
+    with metrics.endpoint("get_similar_concepts"):
+        resources.require("BCV_list", "BCV_knn_graph")
+        concept_index = get_BCV_index(concept_query)
+        if concept_index is None:
+            return {"error": f"Concept {concept_query} not found in BioConceptVectors."}
+        if not exact:
+            similar = endpoints.graph_similar_concepts(resources, concept_index, k)
+            if similar is not None:
+                return similar
+
+        resources.require("BCV_store", "BCV_ann_index", "BCV_quantized")
+        concept_vector = get_BCV_vector(concept_query)
+        return endpoints.top_BCV_matches(resources, concept_vector, k, exact=exact)[0]
+
+
+def get_BCV_index(query: str):
+    return endpoints.BCV_index(resources, query)
 
 
 def get_BCV_vector(query: str):
-    query_index = np.where(BCV_list == query)[0][0]
-    query_vector = BCV_values[query_index]
-    return query_vector
+    return endpoints.BCV_vector(resources, query)
 
 
 def map_BCV_to_description(unmapped: str):
-    mapped = BCV_descriptions[unmapped] if unmapped in BCV_descriptions else "N/A"
-    if type(mapped) == list:
-        mapped = " or ".join(mapped)
-    return mapped
+    index = get_BCV_index(unmapped)
+    return "N/A" if index is None else endpoints.row_description(resources, index)
 
 
 """
@@ -65,158 +181,274 @@ where Q is the query and B, C, D are free variables.
 """
 
 
-@stub.function(cpu=2, memory=2048, container_idle_timeout=300, keep_warm=1)
+@stub.function(
+    cpu=2,
+    memory=2048,
+    container_idle_timeout=300,
+    keep_warm=1,
+    shared_volumes={CACHE_DIR: cache_volume},
+)
 @modal.web_endpoint(method="GET")
 def free_var_search(
     query: str,
     n: int = 1_000,
     sim_threshold: float = 0.80,
     use_gpt: GPTVersion = GPTVersion.NONE,
+    explain_top: int = 1,
+    block_size: int = EQUATION_BLOCK_SIZE,
+    seed: int = None,
+    stratify: bool = False,
+    guided: bool = False,
+    anchors: Optional[List[str]] = Query(None),
+    neighbourhood_size: int = NEIGHBOURHOOD_SIZE,
 ):
-    q = query.strip("\n")
-    if q not in BCV_list:
-        return {
-            "error": f"Query {q} not found in BioConceptVectors. Please try another query."
-        }
-    q_mapped = map_BCV_to_description(q)
-    print(f"----- Performing free variable search for {q_mapped} ({query})... -----")
-    start_freevar = time.time()
-
-    # Get the query vector from BCV embeddings
-    q_vector = get_BCV_vector(q)
-
-    # Perform the free variable search
-    # - generate n random equations (B, C) pairs by picking indices from 0-->len(BCV_list)
-    print(f"- Generating {n} equation samples...", end=" ", flush=True)
-    start = time.time()
-    equation_indices = np.random.choice(len(BCV_list), size=(n, 2))
-    print(f"Done in {time.time() - start} seconds")
-
-    print(f"- Computing B, C, D vectors...", end=" ", flush=True)
-    start = time.time()
-
-    # use indices to get B, C vectors
-    b_vectors = BCV_values[equation_indices[:, 0]]
-    c_vectors = BCV_values[equation_indices[:, 1]]
-
-    # compute D vector
-    d_vectors = q_vector.repeat(n).reshape(n, -1) + b_vectors - c_vectors
-    print(f"Done in {time.time() - start} seconds")
-
-    # compute cosine similarity between D and all BCVs
-    print(f"- Computing cosine similarities...", end=" ", flush=True)
-    start = time.time()
-    sims = cosine_similarity(d_vectors, BCV_values)
-    print(f"Done in {time.time() - start} seconds")
-
-    # get top 4 results
-    print(f"- Indexing results...", end=" ", flush=True)
-    start = time.time()
-    K = 4  # worst case Q, B, C all in top 3 in which case we pick the 4th
-    indices = np.argpartition(sims, -K, axis=1)[:, -K:].copy()
-
-    # get indices of b, c, q vectors to remove from top 4 (don't want D = one of B, C, Q)
-    b_indices = equation_indices[:, 0]
-    c_indices = equation_indices[:, 1]
-    q_index = np.where(BCV_list == query)[0][0]
-    print(f"Done in {time.time() - start} seconds")
-
-    results = []
-    print(f"- Mapping results to build dataframe...", end=" ", flush=True)
-    start = time.time()
-    for i, (b_idx, c_idx) in tqdm(enumerate(equation_indices), total=n):
-        b = BCV_list[b_idx]
-        c = BCV_list[c_idx]
-
-        # argpartition doesn't sort the top k, so we sort first
-        indices[i] = indices[i][np.argsort(sims[i][indices[i]])][::-1]
-        # then calc d index = remove b, c, q indices from top 5 and get the first one
-        d_idx = indices[i][
-            ~np.isin(
-                indices[i], [b_indices[i], c_indices[i], q_index], assume_unique=True
-            )
-        ][0]
-        d = BCV_list[d_idx]
-        similarity = sims[i][d_idx]
-
-        if similarity < sim_threshold:
-            continue
-
-        # map to descriptions and get equations/similarity
-        b_mapped = map_BCV_to_description(b)
-        c_mapped = map_BCV_to_description(c)
-        d_mapped = map_BCV_to_description(d)
-        eq = f"({query}) + ({b}) - ({c}) = ({d})"
-        eq_mapped = f"{q} (aka {q_mapped}) + {b} (aka {b_mapped}) - {c} (aka {c_mapped}) = {d} (aka {d_mapped})"
-
-        results.append(
-            (
-                eq,
-                q,
-                b,
-                c,
-                d,
-                eq_mapped,
-                q_mapped,
-                b_mapped,
-                c_mapped,
-                d_mapped,
-                similarity,
-            )
+    with metrics.endpoint("free_var_search"):
+        resources.require("BCV_list", "BCV_store", "BCV_quantized", "BCV_descriptions")
+        q = query.strip("\n")
+        q_index = get_BCV_index(q)
+        if q_index is None:
+            return {
+                "error": f"Query {q} not found in BioConceptVectors. Please try another query."
+            }
+        # an unseeded search still logs and returns the seed it used, so it can be
+        # replayed
+        if seed is None:
+            seed = int(np.random.default_rng().integers(2**31))
+
+        # Perform the free variable search over n distinct random (B, C) pairs, one block
+        # of equations at a time so memory stays bounded no matter how large n is
+        require_free_var_pairs(stratify, guided)
+        try:
+            with metrics.span("sample"):
+                pairs = endpoints.free_var_pairs(
+                    resources,
+                    q_index,
+                    n,
+                    seed,
+                    stratify,
+                    guided,
+                    anchors,
+                    neighbourhood_size,
+                )
+        except ValueError as e:
+            return {"error": str(e)}
+        d_sims, b_indices, c_indices, d_indices = endpoints.free_var_results(
+            resources, q_index, pairs, sim_threshold, block_size
         )
+        count_free_var_results(len(pairs[0]), len(d_sims))
+        log_free_var_search(q, seed, len(pairs[0]), len(d_sims), guided, stratify)
 
-    df = pd.DataFrame(
-        results,
-        columns=[
-            "Equation",
-            "Q",
-            "B",
-            "C",
-            "D",
-            "Equation (Mapped)",
-            "Q (Mapped)",
-            "B (Mapped)",
-            "C (Mapped)",
-            "D (Mapped)",
-            "Similarity",
-        ],
-    )
-    print(f"Done in {time.time() - start} seconds")
+        with metrics.span("map"):
+            df = endpoints.free_var_frame(
+                resources, q, q_index, d_sims, b_indices, c_indices, d_indices
+            )
 
-    # sort by similarity
-    df = df.sort_values(by="Similarity", ascending=False).reset_index(drop=True)
+        if use_gpt != GPTVersion.NONE and len(df) > 0:
+            load_openai_key(ENV_PATH)
+            explained = min(explain_top, len(df))
+            with metrics.span("gpt"):
+                df["Rationale"] = "N/A"
+                df.loc[: explained - 1, "Rationale"] = gpt_rationales(
+                    df.loc[: explained - 1, "Equation (Mapped)"].tolist(),
+                    gpt_version=use_gpt,
+                    cache=get_rationale_cache(),
+                )
+        # the seed goes in a header, so the body stays the list of rows
+        return JSONResponse(df.to_dict(orient="records"), headers={"X-Seed": str(seed)})
+
+
+def log_free_var_search(
+    q: str, seed: int, samples: int, hits: int, guided: bool, stratify: bool
+):
+    """One JSON log line per search, with what it takes to replay it."""
+    event = {
+        "event": "free_var_search",
+        "query": q,
+        "seed": seed,
+        "guided": guided,
+        "stratify": stratify,
+        "samples": samples,
+        "hits": hits,
+    }
+    print(json.dumps(event))
+
+
+def count_free_var_results(samples: int, hits: int):
+    """Counts the equations searched and how many passed or missed the threshold."""
+    metrics.inc("samples", samples)
+    metrics.inc("hits", hits)
+    metrics.inc("rejections", samples - hits)
+
+
+def require_free_var_pairs(stratify: bool, guided: bool):
+    """Loads what core.endpoints.free_var_pairs reads beyond the store."""
+    if guided:
+        resources.require("BCV_ann_index", "BCV_knn_graph")
+    elif stratify:
+        resources.require("BCV_types")
 
-    if use_gpt != GPTVersion.NONE:
-        load_openai_key(ENV_PATH)
-        print(
-            f"- Getting {use_gpt} rationales for top 1 of {len(df)} rows...",
-            end=" ",
-            flush=True,
+
+"""
+Streaming free_var_search: same search, but the response is newline-delimited JSON
+events sent as soon as they are available:
+    {"type": "rows", "rows": [...]}           surviving rows of each equation block
+    {"type": "search_done", "rows": <count>, "seed": <seed>}  after the last block
+    {"type": "rationale", "equation": ..., "delta": ...}  rationale tokens, top rows first
+    {"type": "rationale_error", "equation": ..., "error": ...}  if a row's rationale failed
+    {"type": "done"}
+"""
+
+
+@stub.function(
+    cpu=2,
+    memory=2048,
+    container_idle_timeout=300,
+    shared_volumes={CACHE_DIR: cache_volume},
+)
+@modal.web_endpoint(method="GET")
+def free_var_search_stream(
+    query: str,
+    n: int = 1_000,
+    sim_threshold: float = 0.80,
+    use_gpt: GPTVersion = GPTVersion.NONE,
+    explain_top: int = 1,
+    block_size: int = EQUATION_BLOCK_SIZE,
+    seed: int = None,
+    stratify: bool = False,
+    guided: bool = False,
+    anchors: Optional[List[str]] = Query(None),
+    neighbourhood_size: int = NEIGHBOURHOOD_SIZE,
+):
+    with metrics.endpoint("free_var_search_stream"):
+        resources.require("BCV_list", "BCV_store", "BCV_quantized", "BCV_descriptions")
+        q = query.strip("\n")
+        q_index = get_BCV_index(q)
+        if q_index is None:
+            return {
+                "error": f"Query {q} not found in BioConceptVectors. Please try another query."
+            }
+        # an unseeded search still reports the seed it used, so it can be replayed
+        if seed is None:
+            seed = int(np.random.default_rng().integers(2**31))
+        require_free_var_pairs(stratify, guided)
+        try:
+            with metrics.span("sample"):
+                pairs = endpoints.free_var_pairs(
+                    resources,
+                    q_index,
+                    n,
+                    seed,
+                    stratify,
+                    guided,
+                    anchors,
+                    neighbourhood_size,
+                )
+        except ValueError as e:
+            return {"error": str(e)}
+        # the events are produced after this returns, so they are timed per event
+        events = iter_free_var_events(
+            q,
+            q_index,
+            pairs,
+            seed,
+            sim_threshold,
+            use_gpt,
+            explain_top,
+            block_size,
         )
-        start = time.time()
-        df["Rationale"] = df["Equation (Mapped)"].apply(lambda _: "N/A")
-        df.loc[0, "Rationale"] = gpt_rationale(
-            df.loc[0, "Equation (Mapped)"], gpt_version=use_gpt
+        return StreamingResponse(
+            metrics.iter_in_endpoint(events, "free_var_search_stream"),
+            media_type="application/x-ndjson",
         )
 
-    print(
-        f"----- Finished Free Variable Search in {time.time() - start_freevar} seconds -----"
+
+def iter_free_var_events(
+    q: str,
+    q_index: int,
+    pairs,
+    seed: int,
+    sim_threshold: float,
+    use_gpt: GPTVersion,
+    explain_top: int,
+    block_size: int,
+):
+    blocks = []
+    search = endpoints.iter_free_var_blocks(
+        resources, q_index, pairs, sim_threshold, block_size
     )
-    return df.to_dict(orient="records")
+    while True:
+        with metrics.span("search_block"):
+            block = next(search, None)
+        if block is None:
+            break
+        blocks.append(block)
+        if len(block[0]) > 0:
+            with metrics.span("map"):
+                df = endpoints.free_var_frame(resources, q, q_index, *block)
+                rows = df.to_dict(orient="records")
+            yield json.dumps({"type": "rows", "rows": rows}) + "\n"
+
+    results = concat_results(blocks)
+    count_free_var_results(len(pairs[0]), len(results[0]))
+    event = {"type": "search_done", "rows": len(results[0]), "seed": seed}
+    yield json.dumps(event) + "\n"
+
+    if use_gpt != GPTVersion.NONE and len(results[0]) > 0:
+        load_openai_key(ENV_PATH)
+        top = endpoints.free_var_frame(
+            resources, q, q_index, *(column[:explain_top] for column in results)
+        )
+        for equation, mapped in zip(top["Equation"], top["Equation (Mapped)"]):
+            start = time.perf_counter()
+            try:
+                for delta in gpt_rationale_stream(
+                    mapped, use_gpt, cache=get_rationale_cache()
+                ):
+                    event = {"type": "rationale", "equation": equation, "delta": delta}
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                # only this row's rationale is lost, the stream goes on with the next
+                print(f"- Rationale stream failed: {e!r}")
+                metrics.inc("rationale_errors")
+                event = {"type": "rationale_error", "equation": equation, "error": str(e)}
+                yield json.dumps(event) + "\n"
+            # includes the time the client took to consume the deltas
+            metrics.observe("gpt", time.perf_counter() - start)
+
+    yield json.dumps({"type": "done"}) + "\n"
+
+
+"""
+Latency histograms per endpoint and stage, and the sample/hit/rejection counters of the
+free variable search, merged over the snapshots every container flushes to the cache
+volume. Prometheus text exposition by default, or a JSON summary with p50/p99 per stage
+with format=json.
+"""
+
+
+@stub.function(shared_volumes={CACHE_DIR: cache_volume})
+@modal.web_endpoint(method="GET")
+def metrics_endpoint(format: str = "prometheus"):
+    metrics.flush()
+    merged = merge_snapshots(read_snapshots(METRICS_DIR))
+    if format == "json":
+        return summarize(merged)
+    return PlainTextResponse(to_prometheus(merged))
 
 
 if __name__ == "__main__":
+    resources.require("BCV_list", "BCV_store", "BCV_quantized", "BCV_descriptions")
     # print(bert_query("dog cancer", 10))
     dog = get_BCV_vector("Species_9615")
     asbestos = get_BCV_vector("Chemical_MESH_D001194")
     dog_cancer = get_BCV_vector("Disease_MESH_D055752")
 
-    sims = cosine_similarity((dog + asbestos).reshape(1, -1), BCV_values)
+    sims = cosine_scores(dog + asbestos, resources.BCV_normed)
     indices = np.argpartition(sims, -20, axis=1)[:, -20:].copy()
     print(indices)
     print(sims[0][indices[0]])
-    results = BCV_list[indices[0]]
+    results = resources.BCV_list[indices[0]]
     print(results)
 
     for i in results:
-        print(map_BCV_to_description(i), sims[0][np.where(BCV_list == i)[0][0]])
+        print(map_BCV_to_description(i), sims[0][get_BCV_index(i)])
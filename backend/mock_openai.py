@@ -0,0 +1,69 @@
+"""
+Minimal local stand-in for the OpenAI chat completions API (plain or streamed), for
+exercising the rationale engine without network access or cost:
+
+    python mock_openai.py 8001 0.5   # port, seconds of latency per request
+    OPENAI_API_BASE=http://localhost:8001/v1 OPENAI_API_KEY=mock python ...
+"""
+import sys
+import json
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+
+class Server(ThreadingHTTPServer):
+    # the default listen backlog of 5 would queue a burst of concurrent requests
+    request_queue_size = 128
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(LATENCY)
+        query = body["messages"][-1]["content"].strip()
+        if body.get("stream"):
+            return self.stream(body["model"], f"Mock: {query}")
+        response = json.dumps(
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"Mock: {query}"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def stream(self, model: str, content: str):
+        """Sends content a word at a time as server-sent chat.completion.chunk events."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for word in content.split(" "):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word + " "}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    Server(("localhost", port), Handler).serve_forever()
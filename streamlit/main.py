@@ -1,19 +1,21 @@
 import streamlit as st
+import json
 import requests
 import pandas as pd
 from typing import List, Tuple
 
 def process_input(user_input: str) -> List[str]:
     url = f'https://degtrdg--bioconceptvecxplorer-bert-query.modal.run/?query={user_input}&top_k=5'
-    r = requests.get(url)
+    r = requests.get(url, timeout=10)
     options: List[Tuple[str, float]] = r.json()
     options_str: List[str] = [f"{concept}| Similarity: {score}" for concept, score in options]
     if not options_str:
         options_str = ["No similar concepts found. Please try again."]
     return options_str
 
-def get_free_var_search(query, sim_threshold, use_gpt=False):
-    base_url = 'https://degtrdg--bioconceptvecxplorer-free-var-search.modal.run'
+def stream_free_var_search(query, sim_threshold, use_gpt=False):
+    """Yields the NDJSON events of the streaming free variable search as they arrive."""
+    base_url = 'https://degtrdg--bioconceptvecxplorer-free-var-search-stream.modal.run'
     n_samples = 100
     if use_gpt:
         gpt = 'gpt-4'
@@ -26,21 +28,12 @@ def get_free_var_search(query, sim_threshold, use_gpt=False):
         'use_gpt':gpt 
     }
 
-    try:
-        response = requests.get(base_url, params=params)
+    # (connect, read) timeouts; the read timeout applies between events, not overall
+    with requests.get(base_url, params=params, stream=True, timeout=(10, 120)) as response:
         response.raise_for_status()
-
-        json_response = response.json()
-
-        if json_response and isinstance(json_response, list):
-            df = pd.DataFrame(json_response)
-            return df
-        else:
-            print("Error: Unexpected response format.")
-            return None
-    except requests.exceptions.RequestException as e:
-        print("Error: Request failed:", e)
-        return None
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
 
 # Set up the Streamlit page
 st.title("BioConceptVec Exploration App")
@@ -75,8 +68,28 @@ if st.button('Process Concept') or st.session_state['user_input'] != '':
                 st.session_state['threshold'] = threshold
                 st.session_state['gpt'] = gpt
                 st.write("Please wait while we process your request...")
-                df = get_free_var_search(extracted_string, st.session_state['threshold'], st.session_state['gpt'])
+                table = st.empty()
+                rationale_box = st.empty()
+                rows, rationales = [], {}
+                df = None
+                try:
+                    for event in stream_free_var_search(extracted_string, st.session_state['threshold'], st.session_state['gpt']):
+                        if event.get('type') == 'rows':
+                            rows.extend(event['rows'])
+                            df = pd.DataFrame(rows).sort_values(by='Similarity', ascending=False).reset_index(drop=True)
+                            table.dataframe(df)
+                        elif event.get('type') == 'rationale':
+                            rationales[event['equation']] = rationales.get(event['equation'], '') + event['delta']
+                            rationale_box.markdown(rationales[event['equation']])
+                        elif 'error' in event:
+                            st.write(event['error'])
+                except requests.exceptions.RequestException as e:
+                    print("Error: Request failed:", e)
+
                 if df is not None:
+                    if rationales:
+                        df['Rationale'] = df['Equation'].map(rationales).fillna('N/A')
+                        table.dataframe(df)
                     st.write("Here are the results:")
                     st.download_button(
                         label="Download CSV",
@@ -84,5 +97,3 @@ if st.button('Process Concept') or st.session_state['user_input'] != '':
                         file_name="res.csv",
                         mime="text/csv",
                     )
-
-                    st.dataframe(df)
@@ -7,11 +7,15 @@ from tqdm import tqdm
 import numpy as np
 import re
 import os
+import sys
 import json
 import modal
 from fastapi import FastAPI
 from sklearn.metrics.pairwise import cosine_similarity
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import load_concept_vectors  # noqa: E402
+
 import os
 import json
 import openai
@@ -64,10 +68,8 @@ def gpt(prompt):
 
 # load concept embedding for all API calls
 print("Cold start - loading concept embeddings...")
-with open("./embeddings/concept_glove.json") as json_file:
-    concept_vectors = json.load(json_file)
-    concept_keys = list(concept_vectors.keys())
-    concept_values = np.array(list(concept_vectors.values()), dtype=np.float32)
+# converted from concept_glove.json by utils.py
+concept_keys, concept_values, concept_index = load_concept_vectors("./embeddings")
 
 print("loading concept descriptions...")
 with open("./mappings/concept_descriptions.pkl", "rb") as f:
@@ -104,9 +106,9 @@ def compute_expression(
         sign, variable = match
         # print(f"Variable: {variable} | Sign: {sign}")
         if sign == "-":
-            result -= concept_vectors[variable]
+            result -= concept_values[concept_index[variable]]
         elif sign == "+":
-            result += concept_vectors[variable]
+            result += concept_values[concept_index[variable]]
         else:
             raise ValueError(f"Invalid operator: {sign}")
 
@@ -156,10 +158,10 @@ def get_similar_concepts(concept_query: str, k: int) -> list:
     if ";" in concept_query:
         concept_query = concept_query.split(";")[0]
     concept_query = rev_concept_descriptions[concept_query]
-    concept = concept_vectors[concept_query]
+    concept = concept_values[concept_index[concept_query]]
     similarities = cosine_similarity(concept_values, [concept]).flatten()
     top_concepts = {}
-    for concept, similarity in zip(concept_vectors.keys(), similarities):
+    for concept, similarity in zip(concept_keys, similarities):
         top_concepts[concept] = similarity
     top_concepts = dict(
         sorted(top_concepts.items(),
@@ -171,11 +173,11 @@ def get_similar_concepts(concept_query: str, k: int) -> list:
 @stub.function()
 @modal.web_endpoint(method="GET")
 def free_var_search(term: str, sim_threshold=0.7, n=100, top_k=3, use_gpt=False):
-    term_vec = concept_vectors[term]
+    term_vec = concept_values[concept_index[term]]
     expressions = []
 
     # randomly pick 1000 pairs of concepts for b, c
-    concepts = list(concept_vectors.keys())
+    concepts = concept_keys
     equations = []
     for _ in range(n):
         b, c = random.sample(concepts, 2)
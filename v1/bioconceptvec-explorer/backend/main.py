@@ -1,15 +1,16 @@
 import streamlit as st
-import json
+import os
+import sys
 import numpy as np
 import re
 from sklearn.metrics.pairwise import cosine_similarity
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import load_concept_vectors  # noqa: E402
+
 # load concept embedding for all API calls
 st.write("Cold start - loading concept embeddings...")
-with open("../embeddings/concept_glove.json") as json_file:
-    concept_vectors = json.load(json_file)
-    concept_keys = list(concept_vectors.keys())
-    concept_values = np.array(list(concept_vectors.values()), dtype=np.float32)
+concept_keys, concept_values, concept_index = load_concept_vectors("../embeddings")
 st.write("Done!")
 
 
@@ -29,9 +30,9 @@ def compute_expression(expression: str, k: int = 10, useCosineSimilarity: bool =
         sign, variable = match
         st.write(f"Variable: {variable} | Sign: {sign}")
         if sign == "-":
-            result -= concept_vectors[variable]
+            result -= concept_values[concept_index[variable]]
         elif sign == "+":
-            result += concept_vectors[variable]
+            result += concept_values[concept_index[variable]]
         else:
             raise ValueError(f"Invalid operator: {sign}")
 
@@ -58,16 +59,16 @@ def compute_expression(expression: str, k: int = 10, useCosineSimilarity: bool =
 def autosuggest(query: str, limit: int) -> list:
     # filter concept vectors based on whether query is a substring
     query = query.lower()
-    lower_concept_vectors = map(lambda x: x.lower(), concept_vectors.keys())
+    lower_concept_vectors = map(lambda x: x.lower(), concept_keys)
     result = [concept for concept in lower_concept_vectors if query in concept]
     return result[:limit]
 
 
 def get_similar_concepts(concept_query: str, k: int) -> list:
-    concept = concept_vectors[concept_query]
+    concept = concept_values[concept_index[concept_query]]
     similarities = cosine_similarity(concept_values, [concept]).flatten()
     top_concepts = {}
-    for concept, similarity in zip(concept_vectors.keys(), similarities):
+    for concept, similarity in zip(concept_keys, similarities):
         top_concepts[concept] = similarity
     top_concepts = dict(sorted(top_concepts.items(),
                         key=lambda item: item[1], reverse=True)[:k])
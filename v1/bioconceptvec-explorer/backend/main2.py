@@ -6,6 +6,7 @@ import numpy as np
 from tqdm import tqdm
 import openai
 import os
+import sys
 import faiss
 import pandas as pd
 import streamlit_pandas as sp
@@ -13,6 +14,9 @@ from sentence_transformers import SentenceTransformer
 import json
 from sklearn.metrics.pairwise import cosine_similarity
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import load_concept_vectors  # noqa: E402
+
 # Load concept_descriptions function
 # load concept embedding for all API calls
 st.write("Cold start - loading concept embeddings...")
@@ -50,10 +54,8 @@ def load_sentences():
 def load_concept_values():
     # load concept embedding for all API calls
     print("Cold start - loading concept embeddings...")
-    with open("./embeddings/concept_glove.json") as json_file:
-        concept_vectors = json.load(json_file)
-        concept_keys = list(concept_vectors.keys())
-        return np.array(list(concept_vectors.values()), dtype=np.float32)
+    _, concept_values, _ = load_concept_vectors("./embeddings")
+    return np.asarray(concept_values)
 
 
 @st.cache_data
@@ -71,11 +73,8 @@ def load_rev_concept_description():
                 rev_concept_descriptions[value] = key
 
 
-with open("./embeddings/concept_glove.json") as json_file:
-    print("loading concept glove.json")
-    concept_vectors = json.load(json_file)
-    concept_keys = list(concept_vectors.keys())
-    concept_values = np.array(list(concept_vectors.values()), dtype=np.float32)
+print("loading concept vectors")
+concept_keys, concept_values, concept_index = load_concept_vectors("./embeddings")
 
 # Load the necessary data
 concept_descriptions = load_concept_descriptions()
@@ -154,9 +153,9 @@ def compute_expression(
         sign, variable = match
         # print(f"Variable: {variable} | Sign: {sign}")
         if sign == "-":
-            result -= concept_vectors[variable]
+            result -= concept_values[concept_index[variable]]
         elif sign == "+":
-            result += concept_vectors[variable]
+            result += concept_values[concept_index[variable]]
         else:
             raise ValueError(f"Invalid operator: {sign}")
 
@@ -200,10 +199,10 @@ def get_similar_concepts(concept_query: str, k: int) -> list:
     if ";" in concept_query:
         concept_query = concept_query.split(";")[0]
     concept_query = rev_concept_descriptions[concept_query]
-    concept = concept_vectors[concept_query]
+    concept = concept_values[concept_index[concept_query]]
     similarities = cosine_similarity(concept_values, [concept]).flatten()
     top_concepts = {}
-    for concept, similarity in zip(concept_vectors.keys(), similarities):
+    for concept, similarity in zip(concept_keys, similarities):
         top_concepts[concept] = similarity
     top_concepts = dict(
         sorted(top_concepts.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -213,11 +212,11 @@ def get_similar_concepts(concept_query: str, k: int) -> list:
 
 def free_var_search(term: str, sim_threshold=0.7, n=100, top_k=3, use_gpt=False):
     print("Running free var search!!")
-    term_vec = concept_vectors[term]
+    term_vec = concept_values[concept_index[term]]
     expressions = []
 
     # randomly pick 1000 pairs of concepts for b, c
-    concepts = list(concept_vectors.keys())
+    concepts = concept_keys
     equations = []
     for _ in range(n):
         b, c = random.sample(concepts, 2)
@@ -0,0 +1,87 @@
+"""
+Minimal local stand-in for the NCBI E-utilities esummary endpoint (gene as JSON,
+taxonomy as XML, ids by GET query or POST form), for exercising mappings.py without
+network access or rate limits:
+
+    python fake_eutils.py 8002 0.05 0.1   # port, seconds of latency, failure rate
+    EUTILS_URL=http://localhost:8002 python mappings.py ...
+
+Every id resolves to a made-up name, except ids ending in 0 which are reported as
+missing. GET /stats returns how many esummary requests have been served.
+"""
+import sys
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+FAILURE_RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+stats = {"requests": 0, "ids": 0}
+stats_lock = threading.Lock()
+
+
+def gene_summary(ids: list):
+    result = {"uids": ids}
+    for id in ids:
+        if id.endswith("0"):
+            result[id] = {"uid": id, "error": "cannot get document summary"}
+        else:
+            result[id] = {"uid": id, "name": f"GENE{id}", "description": f"gene {id}"}
+    return "application/json", json.dumps({"header": {}, "result": result})
+
+
+def taxonomy_summary(ids: list):
+    docs = "".join(
+        f"<DocSum><Id>{id}</Id>"
+        f'<Item Name="ScientificName" Type="String">species {id}</Item></DocSum>'
+        for id in ids
+        if not id.endswith("0")
+    )
+    return "text/xml", f"<eSummaryResult>{docs}</eSummaryResult>"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status: int, content_type: str, body: str):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def esummary(self, params: dict):
+        time.sleep(LATENCY)
+        if random.random() < FAILURE_RATE:
+            return self.respond(503, "application/json", "{}")
+        ids = params["id"][0].split(",")
+        with stats_lock:
+            stats["requests"] += 1
+            stats["ids"] += len(ids)
+        if params["db"][0] == "gene":
+            self.respond(200, *gene_summary(ids))
+        else:
+            self.respond(200, *taxonomy_summary(ids))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith("/stats"):
+            return self.respond(200, "application/json", json.dumps(stats))
+        self.esummary(parse_qs(url.query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        self.esummary(parse_qs(body))
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8002
+    ThreadingHTTPServer(("localhost", port), Handler).serve_forever()
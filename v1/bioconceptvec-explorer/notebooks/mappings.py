@@ -1,73 +1,178 @@
-from ratelimiter import RateLimiter
-from tenacity import retry, stop_after_attempt, wait_fixed
+"""
+Builds concept_descriptions.pkl: a description for every concept in concept_glove.json,
+fetched from NCBI (Gene, Species), MeSH (Disease, Chemical), Cellosaurus (CellLine) and
+dbSNP (SNP, ProteinMutation).
+
+All requests share one aiohttp session with pooled keep-alive connections, and each
+upstream has a single token bucket that every request to it goes through. Results are
+checkpointed to an SQLite file as they arrive, so rerunning after a crash only fetches
+the concepts that are still missing. Gene and Species concepts are resolved in batches
+of EUTILS_BATCH_SIZE ids per E-utilities esummary call rather than one call each.
+
+With --incremental, the descriptions of a previous concept_descriptions.pkl are
+reused: only concepts that are new to the vocabulary or whose previous fetch failed
+(None) are fetched, so a refresh after a vocabulary update costs as much as the diff.
+
+Every upstream's base URL can be overridden with an environment variable (EUTILS_URL,
+MESH_URL, CELLOSAURUS_URL, DBSNP_URL) to run against local stub servers, e.g.
+fake_eutils.py for NCBI.
+
+    python mappings.py embeddings/concept_glove.json datasets/concept_descriptions.pkl
+    python mappings.py embeddings/concept_glove.json datasets/concept_descriptions.pkl \
+        --incremental datasets/concept_descriptions.pkl
+"""
+import os
+import sys
+import json
 import pickle
-import requests
+import asyncio
+import sqlite3
+import argparse
+import functools
 import xml.etree.ElementTree as ET
-import json
+import aiohttp
 from tqdm import tqdm
-from queue import Queue
-from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
-from threading import Lock
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import iter_glove_json  # noqa: E402
+
+# shared with the backend's rationale engine; utils puts backend/ on the path
+from core.ratelimit import TokenBucket  # noqa: E402
+
+EUTILS_URL = os.getenv("EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+MESH_URL = os.getenv("MESH_URL", "https://id.nlm.nih.gov/mesh")
+CELLOSAURUS_URL = os.getenv("CELLOSAURUS_URL", "https://api.cellosaurus.org")
+DBSNP_URL = os.getenv("DBSNP_URL", "https://api.ncbi.nlm.nih.gov/variation/v0/beta")
+NCBI_API_KEY = os.getenv("NCBI_API_KEY", "08c3e5645f832a8ef99f034c2e9dd39a7d09")
+
+# requests per second allowed to each upstream, across all in-flight fetches
+RATE_LIMITS = {"ncbi": 9, "mesh": 9, "cellosaurus": 9, "dbsnp": 9}
+
+MAX_IN_FLIGHT = 64
+MAX_CONNECTIONS = 32
+REQUEST_TIMEOUT = 30
+# ids per esummary call; sent as a POST body, so long id lists are fine
+EUTILS_BATCH_SIZE = 200
+# checkpointed results are committed to disk every this many concepts
+COMMIT_EVERY = 200
+
+
+class RetryableStatus(Exception):
+    pass
+
 
-q = Queue()
-pbar_lock = Lock()
-# Fetch the gene description from NCBI Entrez
+class Client:
+    """The shared session plus one token bucket per upstream."""
 
+    def __init__(self, session: aiohttp.ClientSession, rate_limits: dict = RATE_LIMITS):
+        self.session = session
+        self.buckets = {name: TokenBucket(rate) for name, rate in rate_limits.items()}
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(0.2))
-@RateLimiter(max_calls=9, period=1)
-def fetch_entrez_gene(id):
-    url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-    params = {
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_fixed(0.2),
+        retry=retry_if_exception_type(
+            (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus)
+        ),
+    )
+    async def request(
+        self,
+        upstream: str,
+        url: str,
+        method: str = "GET",
+        as_json: bool = True,
+        **kwargs,
+    ):
+        """Response body, or None for any non-200 answer that isn't retried."""
+        await self.buckets[upstream].acquire()
+        async with self.session.request(method, url, **kwargs) as response:
+            if response.status == 429 or response.status >= 500:
+                raise RetryableStatus(f"{response.status} from {url}")
+            if response.status != 200:
+                return None
+            if as_json:
+                return await response.json(content_type=None)
+            return await response.read()
+
+
+# Fetch gene descriptions from NCBI Entrez, for a batch of ids per request
+
+
+async def fetch_entrez_genes(client: Client, ids: list):
+    """Maps each id that esummary found to its description."""
+    data = {
         "db": "gene",
-        "id": id,
+        "id": ",".join(ids),
         "retmode": "json",
-        "api_key": "08c3e5645f832a8ef99f034c2e9dd39a7d09"
+        "api_key": NCBI_API_KEY,
     }
-    response = requests.get(url, params=params)
-    return response.json()["result"][id]["description"] if response.status_code == 200 else None
+    result = await client.request(
+        "ncbi", f"{EUTILS_URL}/esummary.fcgi", method="POST", data=data
+    )
+    if not result:
+        return {}
+    summaries = result.get("result", {})
+    return {
+        id: summaries[id]["description"]
+        for id in summaries.get("uids", [])
+        if summaries[id].get("description")
+    }
+
+
+async def fetch_entrez_gene(client: Client, id):
+    return (await fetch_entrez_genes(client, [id])).get(id)
+
 
 # Fetch the disease name from MESH
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(0.2))
-@RateLimiter(max_calls=9, period=1)
-def fetch_mesh_descriptor(id):
-    url = f"https://id.nlm.nih.gov/mesh/lookup/label?resource={id}"
-    headers = {"Accept": "application/json"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200 and response.json():
-        return response.json()[0]
-    else:
-        return None
+async def fetch_mesh_descriptor(client: Client, id):
+    result = await client.request(
+        "mesh",
+        f"{MESH_URL}/lookup/label",
+        params={"resource": id},
+        headers={"Accept": "application/json"},
+    )
+    return result[0] if result else None
 
-# Fetch the species scientific name from NCBI taxonomy
 
+# Fetch species scientific names from NCBI taxonomy, for a batch of ids per request
+
+
+async def fetch_ncbi_species_batch(client: Client, ids: list):
+    """Maps each id that esummary found to its scientific name."""
+    data = {"db": "taxonomy", "id": ",".join(ids), "api_key": NCBI_API_KEY}
+    content = await client.request(
+        "ncbi", f"{EUTILS_URL}/esummary.fcgi", method="POST", as_json=False, data=data
+    )
+    if content is None:
+        return {}
+    names = {}
+    for doc in ET.fromstring(content).iter("DocSum"):
+        name = doc.find('Item[@Name="ScientificName"]')
+        if name is not None and name.text:
+            names[doc.findtext("Id")] = name.text
+    return names
+
+
+async def fetch_ncbi_species(client: Client, id):
+    return (await fetch_ncbi_species_batch(client, [id])).get(id)
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(0.2))
-@RateLimiter(max_calls=9, period=1)
-def fetch_ncbi_species(id):
-    url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=taxonomy&id={id}&api_key=08c3e5645f832a8ef99f034c2e9dd39a7d09"
-    response = requests.get(url)
-    if response.status_code == 200:
-        root = ET.fromstring(response.content)
-        return root.find('.//Item[@Name="ScientificName"]').text
-    else:
-        return None
 
 # Fetch the cell line from Cellosaurus
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(0.2))
-@RateLimiter(max_calls=9, period=1)
-def fetch_cellosaurus(id):
-    url = f"https://api.cellosaurus.org/cell-line/{id}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return [value['value'] for name in response.json().get('Cellosaurus', {}).get('cell-line-list', []) for value in name.get('name-list', [])]
-    else:
+async def fetch_cellosaurus(client: Client, id):
+    result = await client.request("cellosaurus", f"{CELLOSAURUS_URL}/cell-line/{id}")
+    if result is None:
         return None
+    return [
+        value["value"]
+        for name in result.get("Cellosaurus", {}).get("cell-line-list", [])
+        for value in name.get("name-list", [])
+    ]
+
 
 # Fetch the SNP from dbSNP
 
@@ -95,49 +200,101 @@ def parse_dbsnp(dbsnp_json):
         return None
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(0.2))
-@RateLimiter(max_calls=9, period=1)
-def fetch_dbsnp(rs_id):
-    url = f"https://api.ncbi.nlm.nih.gov/variation/v0/beta/refsnp/{rs_id}&api_key=08c3e5645f832a8ef99f034c2e9dd39a7d09"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return parse_dbsnp(response.json())
-    else:
-        return None
+async def fetch_dbsnp(client: Client, rs_id):
+    result = await client.request(
+        "dbsnp", f"{DBSNP_URL}/refsnp/{rs_id}", params={"api_key": NCBI_API_KEY}
+    )
+    return parse_dbsnp(result)
+
 
 # Fetch the concept description
 
+BATCH_FETCHERS = {"Gene": fetch_entrez_genes, "Species": fetch_ncbi_species_batch}
 
-def fetch_concept_description(concept_id):
+
+def batch_id(concept_id):
+    """(concept_type, id) for concepts resolved in esummary batches, else None."""
+    concept_type, identifier = concept_id.split('_', 1)
+    if concept_type not in BATCH_FETCHERS:
+        return None
+    if concept_type == "Gene":
+        # If there are any more '_' in the identifier, split and take the first part
+        identifier = identifier.split('_')[0]
+    return concept_type, identifier
+
+
+async def fetch_batch_descriptions(client: Client, concept_type: str, batch: list):
+    """
+    Resolves (concept, id) pairs of one type with a single esummary call and returns
+    (concept, description) pairs. Ids missing from the response get None, as the
+    single-id lookups always gave them, and so does every id if the whole call fails.
+    """
+    try:
+        found = await BATCH_FETCHERS[concept_type](client, [id for _, id in batch])
+    except Exception as e:
+        print(f"An error occurred in fetch_batch_descriptions: {e}")
+        return [(concept, None) for concept, _ in batch]
+    return [(concept, found.get(id)) for concept, id in batch]
+
+
+async def fetch_single_description(client: Client, concept_id):
+    return [(concept_id, await fetch_concept_description(client, concept_id))]
+
+
+def plan_fetches(client: Client, concepts: list, batch_size: int = EUTILS_BATCH_SIZE):
+    """
+    Splits the concepts into fetch jobs: one per esummary batch of Gene or Species
+    concepts and one per other concept. Each job returns (concept, description) pairs.
+    """
+    batches = {concept_type: [] for concept_type in BATCH_FETCHERS}
+    jobs = []
+    for concept in concepts:
+        key = batch_id(concept) if '_' in concept else None
+        if key is None:
+            jobs.append(functools.partial(fetch_single_description, client, concept))
+        else:
+            batches[key[0]].append((concept, key[1]))
+    for concept_type, batch in batches.items():
+        for start in range(0, len(batch), batch_size):
+            jobs.append(
+                functools.partial(
+                    fetch_batch_descriptions,
+                    client,
+                    concept_type,
+                    batch[start : start + batch_size],
+                )
+            )
+    return jobs
+
+
+async def fetch_concept_description(client: Client, concept_id):
     try:
-        # When finished, put a dummy item in the queue to signal one task's completion
-        q.put(None)
         concept_type, identifier = concept_id.split('_', 1)
         result = None
         if concept_type == "Disease":
             if identifier.startswith("MESH"):
                 identifier = identifier[identifier.find('_')+1:]
-                result = fetch_mesh_descriptor(identifier)
+                result = await fetch_mesh_descriptor(client, identifier)
             else:
                 result = identifier[identifier.find('_')+1:].replace('_', ' ')
         elif concept_type == "Gene":
             # If there are any more '_' in the identifier, split and take the first part
             if '_' in identifier:
                 identifier = identifier.split('_')[0]
-            result = fetch_entrez_gene(identifier)
+            result = await fetch_entrez_gene(client, identifier)
         elif concept_type == "Species":
-            result = fetch_ncbi_species(identifier)
+            result = await fetch_ncbi_species(client, identifier)
         elif concept_type == "CellLine":
-            result = fetch_cellosaurus(identifier)
+            result = await fetch_cellosaurus(client, identifier)
         elif concept_type == "ProteinMutation":
             identifier = identifier[identifier.rfind('_')+1:]
-            result = fetch_dbsnp(identifier)
+            result = await fetch_dbsnp(client, identifier)
         elif concept_type == "SNP":
             identifier = identifier[2:]
-            result = fetch_dbsnp(identifier)
+            result = await fetch_dbsnp(client, identifier)
         elif concept_type == "Chemical":
             identifier = identifier[identifier.find('_')+1:]
-            result = fetch_mesh_descriptor(identifier)
+            result = await fetch_mesh_descriptor(client, identifier)
         elif concept_type == "DNAMutation":
             result = concept_type + ' ' + identifier.replace('_', ' ')
         elif concept_type == "DomainMotif":
@@ -154,33 +311,127 @@ def fetch_concept_description(concept_id):
         return None
 
 
-YOUR_JSON_PATH = '/Users/danielgeorge/Documents/work/ml/bioconceptvec-explorer/bioconceptvec-explorer/embeddings/concept_glove.json'
+class Checkpoint:
+    """
+    Fetched descriptions by concept, in an SQLite file. Values are stored as JSON, so
+    strings, lists and None (a failed fetch) all round-trip.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS descriptions"
+            " (concept TEXT PRIMARY KEY, description TEXT)"
+        )
+        self.db.commit()
+        self.pending = 0
+
+    def done(self, include_failed: bool = True):
+        query = "SELECT concept FROM descriptions"
+        if not include_failed:
+            query += " WHERE description != 'null'"
+        return {row[0] for row in self.db.execute(query)}
+
+    def seed(self, descriptions: dict):
+        """Adds previously fetched descriptions, keeping any already checkpointed."""
+        self.db.executemany(
+            "INSERT OR IGNORE INTO descriptions VALUES (?, ?)",
+            ((concept, json.dumps(d)) for concept, d in descriptions.items()),
+        )
+        self.commit()
+
+    def put(self, concept: str, description):
+        self.db.execute(
+            "INSERT OR REPLACE INTO descriptions VALUES (?, ?)",
+            (concept, json.dumps(description)),
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def items(self):
+        for concept, description in self.db.execute("SELECT * FROM descriptions"):
+            yield concept, json.loads(description)
+
 
-# Load concepts from JSON
-with open(YOUR_JSON_PATH) as json_file:
-    concept_vectors = json.load(json_file)
-# Convert keys to list for subscription
-concept_keys = list(concept_vectors.keys())
+async def enrich(
+    concepts: list,
+    checkpoint: Checkpoint,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    rate_limits: dict = RATE_LIMITS,
+    batch_size: int = EUTILS_BATCH_SIZE,
+    retry_failed: bool = False,
+):
+    """
+    Fetches and checkpoints the description of every concept not checkpointed yet, and
+    of the ones checkpointed as None if retry_failed.
+    """
+    done = checkpoint.done(include_failed=not retry_failed)
+    todo = [concept for concept in concepts if concept not in done]
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        client = Client(session, rate_limits)
+        with tqdm(total=len(concepts), initial=len(concepts) - len(todo)) as pbar:
+            jobs = iter(plan_fetches(client, todo, batch_size))
 
-# Fetch the descriptions
-concept_descriptions = {concept: None for concept in concept_keys}
+            async def worker():
+                # every worker pulls from the same iterator until it is exhausted
+                for job in jobs:
+                    for concept, description in await job():
+                        checkpoint.put(concept, description)
+                        pbar.update()
 
+            try:
+                await asyncio.gather(*(worker() for _ in range(max_in_flight)))
+            finally:
+                checkpoint.commit()
 
-def update_concept_description(concept):
-    concept_descriptions.update({concept: fetch_concept_description(concept)})
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("glove_path")
+    parser.add_argument("out_path")
+    parser.add_argument("--checkpoint", default="concept_descriptions.sqlite")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--batch-size", type=int, default=EUTILS_BATCH_SIZE)
+    parser.add_argument(
+        "--incremental",
+        metavar="PREVIOUS_PKL",
+        help="reuse this pickle's descriptions and only fetch new or failed concepts",
+    )
+    args = parser.parse_args()
 
-with tqdm(total=len(concept_descriptions)) as pbar:
-    # max_workers can be adjusted
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(update_concept_description, concept)
-                   for concept in concept_descriptions.keys()}
+    # Only the keys are kept, the vectors are streamed past
+    concept_keys = [key for key, _ in iter_glove_json(args.glove_path)]
 
-        for future in concurrent.futures.as_completed(futures):
-            q.get()
-            with pbar_lock:
-                pbar.update()
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.incremental:
+        with open(args.incremental, 'rb') as f:
+            previous = pickle.load(f)
+        added = set(concept_keys).difference(previous)
+        failed = {concept for concept in concept_keys if previous.get(concept) is None}
+        print(
+            f"{len(added)} new concepts, {len(failed - added)} previously failed, "
+            f"{len(set(previous).difference(concept_keys))} removed"
+        )
+        checkpoint.seed(previous)
+    asyncio.run(
+        enrich(
+            concept_keys,
+            checkpoint,
+            args.max_in_flight,
+            batch_size=args.batch_size,
+            retry_failed=bool(args.incremental),
+        )
+    )
 
-# Save to pickle file
-with open('/Users/danielgeorge/Documents/work/ml/bioconceptvec-explorer/bioconceptvec-explorer/datasets/concept_descriptions.pkl', 'wb') as f:
-    pickle.dump(concept_descriptions, f)
+    # Save to pickle file, in vocabulary order
+    fetched = dict(checkpoint.items())
+    concept_descriptions = {concept: fetched.get(concept) for concept in concept_keys}
+    with open(args.out_path, 'wb') as f:
+        pickle.dump(concept_descriptions, f)
@@ -7,11 +7,20 @@ from tqdm import tqdm
 import numpy as np
 import re
 import os
+import sys
 import json
 import modal
 from fastapi import FastAPI
 from sklearn.metrics.pairwise import cosine_similarity
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import load_concept_vectors  # noqa: E402
+
+# the backend's autosuggest index; mounted at /root/core/suggest.py in the image
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SERVER_DIR, "..", "..", "..", "backend"))
+from core.suggest import build_suggest_index, suggest_rows  # noqa: E402
+
 import os
 import json
 import openai
@@ -44,6 +53,9 @@ mounts = [
     modal.Mount.from_local_dir("./embeddings/", remote_path="/root/embeddings/"),
     modal.Mount.from_local_dir("./mappings/", remote_path="/root/mappings/"),
     modal.Mount.from_local_file("./utils.py", remote_path="/root/utils.py"),
+    modal.Mount.from_local_file(
+        "../../backend/core/suggest.py", remote_path="/root/core/suggest.py"
+    ),
     modal.Mount.from_local_file("./.env", remote_path="/root/.env"),
 ]
 
@@ -76,22 +88,29 @@ def gpt(prompt):
 
 # load concept embedding for all API calls
 print("Cold start - loading concept embeddings...")
-with open("./embeddings/concept_glove.json") as json_file:
-    concept_vectors = json.load(json_file)
-    concept_keys = list(concept_vectors.keys())
-    concept_values = np.array(list(concept_vectors.values()), dtype=np.float32)
+# converted from concept_glove.json by utils.py
+concept_keys, concept_values, concept_index = load_concept_vectors("./embeddings")
 
 print("loading concept descriptions...")
 with open("./mappings/concept_descriptions.pkl", "rb") as f:
     concept_descriptions = pickle.load(f)
     rev_concept_descriptions = {}
+    # the description autosuggest matches and returns for each concept
+    suggest_descriptions = {}
     for key, value in tqdm(concept_descriptions.items()):
         if type(value) == list and len(value) == 0:
             continue
         elif type(value) == list and len(value) > 0:
             rev_concept_descriptions[value[0]] = key
+            suggest_descriptions[key] = value[0]
         else:
             rev_concept_descriptions[value] = key
+            suggest_descriptions[key] = value
+
+print("building autosuggest index...")
+# rows of the index are positions in suggest_concepts
+suggest_concepts = [key for key, value in suggest_descriptions.items() if value]
+suggest_index = build_suggest_index(suggest_concepts, suggest_descriptions)
 
 print("Done!")
 
@@ -116,9 +135,9 @@ def compute_expression(
         sign, variable = match
         # print(f"Variable: {variable} | Sign: {sign}")
         if sign == "-":
-            result -= concept_vectors[variable]
+            result -= concept_values[concept_index[variable]]
         elif sign == "+":
-            result += concept_vectors[variable]
+            result += concept_values[concept_index[variable]]
         else:
             raise ValueError(f"Invalid operator: {sign}")
 
@@ -144,19 +163,10 @@ def compute_expression(
 @stub.function()
 @modal.web_endpoint(method="GET")
 def autosuggest(query: str, limit: int) -> list:
-    # filter concept vectors based on whether query is a substring
-    query = query.lower()
-    descs = list(concept_descriptions.values())
-    for i in range(len(descs)):
-        if type(descs[i]) == list and len(descs[i]) > 0:
-            descs[i] = descs[i][0]
-        elif type(descs[i]) == list and len(descs[i]) == 0:
-            descs[i] = ""
-
-    descs = [i for i in descs if i is not None and i != ""]
-    lower_concept_descs = map(lambda x: x.lower(), descs)
-    result = [concept for concept in lower_concept_descs if query in concept]
-    return result[:limit]
+    # descriptions with a word starting with query, from the prefix index instead of a
+    # scan of every description per keystroke
+    rows = suggest_rows(suggest_index, query, limit)
+    return [suggest_descriptions[suggest_concepts[i]].lower() for i in rows]
 
 
 @stub.function()
@@ -166,10 +176,10 @@ def get_similar_concepts(concept_query: str, k: int) -> list:
     if ";" in concept_query:
         concept_query = concept_query.split(";")[0]
     concept_query = rev_concept_descriptions[concept_query]
-    concept = concept_vectors[concept_query]
+    concept = concept_values[concept_index[concept_query]]
     similarities = cosine_similarity(concept_values, [concept]).flatten()
     top_concepts = {}
-    for concept, similarity in zip(concept_vectors.keys(), similarities):
+    for concept, similarity in zip(concept_keys, similarities):
         top_concepts[concept] = similarity
     top_concepts = dict(
         sorted(top_concepts.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -180,11 +190,11 @@ def get_similar_concepts(concept_query: str, k: int) -> list:
 @stub.function()
 @modal.web_endpoint(method="GET")
 def free_var_search(term: str, sim_threshold=0.6, n=100, use_gpt=False):
-    term_vec = concept_vectors[term]
+    term_vec = concept_values[concept_index[term]]
     expressions = []
 
     # randomly pick 1000 pairs of concepts for b, c
-    concepts = list(concept_vectors.keys())
+    concepts = concept_keys
     equations = []
     for _ in range(n):
         b, c = random.sample(concepts, 2)
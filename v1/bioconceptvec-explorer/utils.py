@@ -0,0 +1,89 @@
+"""
+Compact binary format for the concept embeddings.
+
+concept_glove.json is converted once into two arrays next to it:
+    concept_keys.npy    the concept ids, in file order
+    concept_values.npy  a contiguous (n_concepts, dim) float32 matrix
+The conversion streams the JSON straight into the memory-mapped matrix, so the full
+dict of float lists is never held in memory, and loading is a plain array read (the
+matrix is memory-mapped).
+
+Usage: python utils.py ./embeddings/concept_glove.json ./embeddings/
+"""
+import os
+import re
+import sys
+import json
+import numpy as np
+
+KEYS_FILE = "concept_keys.npy"
+VALUES_FILE = "concept_values.npy"
+
+# a copy of backend/core/glove.py's reader: the v1 Modal image only mounts this file,
+# so it can't import the backend's core package
+_decoder = json.JSONDecoder()
+_separators = re.compile(r"[\s,:]*")
+
+
+def iter_glove_json(path: str, chunk_size: int = 1 << 22):
+    """Yields (concept, vector) pairs from a {"concept": [floats], ...} JSON file."""
+    with open(path) as f:
+        buffer = f.read(chunk_size)
+        pos = buffer.index("{") + 1
+        eof = False
+        while True:
+            pos = _separators.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "}":
+                return
+            try:
+                key, key_end = _decoder.raw_decode(buffer, pos)
+                value_start = _separators.match(buffer, key_end).end()
+                vector, pos = _decoder.raw_decode(buffer, value_start)
+            except json.JSONDecodeError:
+                # the entry straddles the end of the buffer, so read the next chunk
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield key, vector
+
+
+def convert_glove_json(json_path: str, out_dir: str):
+    # a first pass only reads the ids and the dimension, so the matrix can be written
+    # once, straight into a .npy of its final shape
+    keys, dim = [], 0
+    for key, vector in iter_glove_json(json_path):
+        keys.append(key)
+        dim = len(vector)
+
+    values = np.lib.format.open_memmap(
+        os.path.join(out_dir, VALUES_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(keys), dim),
+    )
+    for i, (_, vector) in enumerate(iter_glove_json(json_path)):
+        values[i] = vector
+    values.flush()
+    del values
+    np.save(os.path.join(out_dir, KEYS_FILE), np.array(keys, dtype=str))
+    return len(keys), dim
+
+
+def load_concept_vectors(path: str):
+    """
+    Returns (concept_keys, concept_values, concept_index) from a converted embeddings
+    directory, where concept_index maps a concept id to its row in concept_values.
+    """
+    concept_keys = np.load(os.path.join(path, KEYS_FILE)).tolist()
+    concept_values = np.load(os.path.join(path, VALUES_FILE), mmap_mode="r")
+    concept_index = {key: i for i, key in enumerate(concept_keys)}
+    return concept_keys, concept_values, concept_index
+
+
+if __name__ == "__main__":
+    n, dim = convert_glove_json(sys.argv[1], sys.argv[2])
+    print(f"Converted {n} concepts of dimension {dim}")